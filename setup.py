@@ -8,6 +8,7 @@ CHANGES = open(os.path.join(here, 'CHANGES.rst')).read()
 
 requires = (
     'pyramid',
+    'pyramid_mailer',
     'voteit.core',
     'Babel',
     'lingua',
@@ -34,6 +35,8 @@ setup(name='voteit.importparticipants',
       tests_require= requires,
       test_suite="voteit.importparticipants",
       entry_points = """\
+      [console_scripts]
+      voteit_import_participants = voteit.importparticipants.scripts:import_participants
       """,
       message_extractors = { '.': [
               ('**.py',   'lingua_python', None ),
@@ -3,7 +3,50 @@ from pyramid.i18n import TranslationStringFactory
 
 VoteITImportParticipants = TranslationStringFactory('voteit.importparticipants')
 
+_BASE_EDIT = "voteit.core.views:templates/base_edit.pt"
+
+#: (view name, method of views.AddParticipantsView, extra arguments to add_view)
+VIEWS = (('add_participants', 'add_participants', {'renderer': _BASE_EDIT}),
+         ('add_participants_file', 'add_participants_file', {'renderer': _BASE_EDIT}),
+         ('sync_participants', 'sync_participants', {'renderer': _BASE_EDIT}),
+         ('add_participants_multiple', 'add_participants_multiple', {'renderer': _BASE_EDIT}),
+         ('import_report.csv', 'import_report_csv', {}),
+         ('import_status', 'import_status', {'renderer': "voteit.importparticipants:import_status.pt"}),
+         ('import_status.json', 'import_status_json', {'renderer': "json"}),
+         ('import_result', 'import_result', {}),
+         ('import_credentials.csv', 'import_credentials_csv', {}),
+         ('import_participants.json', 'import_participants_json', {'request_method': 'POST'}),)
+
+
+def lazy_view(attr):
+    """ Return a view that calls attr of views.AddParticipantsView. The views module,
+        with the importer, validators and formats it needs, is imported by the first
+        request instead of when the application starts.
+    """
+    def view(context, request):
+        from voteit.importparticipants.views import AddParticipantsView
+        return getattr(AddParticipantsView(context, request), attr)()
+    view.__name__ = attr
+    return view
+
 
 def includeme(config):
-    config.scan('voteit.importparticipants')
+    """ Registrations are explicit instead of a scan of the package, so tests,
+        benchmarks and the console script are never imported by the web server.
+        The included modules don't import the models, file formats or pyramid_mailer,
+        which are loaded when an import or a mail first needs them. The built-in
+        file formats are used by get_participant_format without being registered.
+    """
+    from voteit.core.models.interfaces import IMeeting
+    from voteit.core.security import MANAGE_GROUPS
+    for (name, attr, kw) in VIEWS:
+        config.add_view(lazy_view(attr), name = name, context = IMeeting, permission = MANAGE_GROUPS, **kw)
+    # first, so the hashing processes are forked before anything starts a thread
+    config.include('voteit.importparticipants.hashing')
+    config.scan('voteit.importparticipants.components')
+    config.scan('voteit.importparticipants.schemas')
+    config.include('voteit.importparticipants.credentials')
+    config.include('voteit.importparticipants.instrumentation')
+    config.include('voteit.importparticipants.jobs')
+    config.include('voteit.importparticipants.mailing')
     config.add_translation_dirs('voteit.importparticipants:locale/')
@@ -0,0 +1,248 @@
+# -*- coding: UTF-8 -*-
+""" Benchmarks for validating, importing and rendering participant rosters.
+
+    Run with: python -m voteit.importparticipants.benchmark --output results.json
+
+    With --startup, the time to include the package in a fresh process is measured too,
+    next to a scan of the whole package like earlier versions did.
+
+    With --hashing, hashing passwords one at a time with the hash method of users is
+    compared with a pool of --hash-processes processes. The pool is started before it's
+    timed, since it's started once with the application. The setting
+    voteit.importparticipants.hash_processes only helps if the pool is faster.
+
+    Every roster size runs in a fresh test configuration with a pre-populated user base.
+    Time is wall clock seconds. Memory is the growth of the process' peak RSS during the
+    phase, so a phase that doesn't raise the peak reports 0.
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+from datetime import datetime
+from time import time
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+_NON_ASCII_NAMES = (u"Åsa", u"Jörg", u"Zoë", u"Ñandú", u"用户", u"Łukasz")
+
+
+def make_roster(rows, duplicate_userids = 0.02, duplicate_emails = 0.02, non_ascii = 0.2, seed = 1):
+    """ Return a synthetic roster as unicode csv. The ratios control how many rows reuse
+        an earlier userid or email, and how many have non-ascii names.
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for n in range(rows):
+        userid = u"bench%s" % n
+        email = u"bench%s@test.com" % n
+        if n and rnd.random() < duplicate_userids:
+            userid = u"bench%s" % rnd.randrange(n)
+        if n and rnd.random() < duplicate_emails:
+            email = u"bench%s@test.com" % rnd.randrange(n)
+        first_name = u"First"
+        if rnd.random() < non_ascii:
+            first_name = rnd.choice(_NON_ASCII_NAMES)
+        lines.append(u"%s;;%s;%s;Last" % (userid, email, first_name))
+    return u"\n".join(lines)
+
+
+def populate_users(root, count):
+    """ Add count users to root.users, without events. """
+    from voteit.core.models.user import User
+    for n in range(count):
+        userid = u"existing%s" % n
+        user = User(email = u"existing%s@test.com" % n, first_name = u"Existing")
+        root.users.add(userid, user, send_events = False)
+
+
+def _max_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(func, *args, **kw):
+    """ Call func and return (result, seconds, peak rss growth in kb). """
+    rss = _max_rss()
+    start = time()
+    result = func(*args, **kw)
+    return (result, time() - start, _max_rss() - rss)
+
+
+class BenchmarkRun(object):
+    """ Fixture for one roster size. """
+
+    def __init__(self, rows, existing_users):
+        from pyramid import testing
+        from voteit.core.models.meeting import Meeting
+        from voteit.core.testing_helpers import bootstrap_and_fixture
+        self.rows = rows
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request = self.request)
+        self.config.testing_securitypolicy(userid = 'admin', permissive = True)
+        self.config.registry.settings['default_timezone_name'] = "Europe/Stockholm"
+        self.config.registry.settings['default_locale_name'] = 'sv'
+        # the synthetic rosters have duplicate emails, validation must not stop at them
+        self.config.registry.settings['voteit.importparticipants.max_errors'] = rows + 1
+        self.config.include('voteit.core.models.date_time_util')
+        self.config.include('voteit.core.models.flash_messages')
+        self.config.scan('voteit.core.views.components')
+        self.root = bootstrap_and_fixture(self.config)
+        populate_users(self.root, existing_users)
+        self.root['m'] = self.meeting = Meeting()
+        self.roster = make_roster(rows)
+
+    def close(self):
+        from pyramid import testing
+        testing.tearDown()
+
+    def validate(self):
+        import colander
+        from voteit.core.views.api import APIView
+        from voteit.importparticipants.schemas import ParticipantsCSV
+        from voteit.importparticipants.validators import CSVParticipantValidator
+        api = APIView(self.meeting, self.request)
+        node = colander.SchemaNode(ParticipantsCSV())
+        participants = node.deserialize(self.roster)
+        # duplicate emails are expected in the synthetic rosters
+        report = CSVParticipantValidator(self.meeting, api).check(participants)
+        if report.full:
+            raise RuntimeError("Validation stopped after %s errors, before the end of the roster" % len(report))
+        return participants
+
+    def import_participants(self, participants):
+        from voteit.core import security
+        from voteit.importparticipants.views import AddParticipantsView
+        view = AddParticipantsView(self.meeting, self.request)
+        return view._import_participants(participants, (security.ROLE_VOTER, ))
+
+    def render(self, output):
+        from pyramid.renderers import render
+        from voteit.importparticipants.views import AddParticipantsView
+        view = AddParticipantsView(self.meeting, self.request)
+        view.response['heading'] = u"%s participants added" % len(output)
+        view.response['participants'] = output
+        return render("voteit.importparticipants:add_participants.pt", view.response, request = self.request)
+
+    def __call__(self):
+        results = []
+        (participants, seconds, rss) = measure(self.validate)
+        results.append(self._result('validate', seconds, rss))
+        (output, seconds, rss) = measure(self.import_participants, participants)
+        results.append(self._result('import', seconds, rss))
+        (html, seconds, rss) = measure(self.render, output)
+        results.append(self._result('render', seconds, rss))
+        return results
+
+    def _result(self, phase, seconds, rss):
+        return {'rows': self.rows,
+                'phase': phase,
+                'seconds': round(seconds, 4),
+                'rows_per_second': seconds and round(self.rows / seconds, 1) or None,
+                'max_rss_growth_kb': rss}
+
+
+# Runs in a fresh interpreter. voteit.core, deform and colander are imported before
+# the clock starts, since the site has loaded them anyway.
+_STARTUP_SCRIPT = """
+import json, sys
+from time import time
+from pyramid.config import Configurator
+import voteit.core.models.schemas
+before = set(sys.modules)
+config = Configurator(settings = {})
+start = time()
+if sys.argv[1] == 'scan':
+    config.scan('voteit.importparticipants')
+else:
+    config.include('voteit.importparticipants')
+config.commit()
+seconds = time() - start
+loaded = [x for x in set(sys.modules) - before if sys.modules[x] is not None]
+json.dump({'seconds': seconds, 'modules': len(loaded),
+           'packages': sorted(set(x.split('.')[0] for x in loaded)),
+           'package_modules': sorted(x for x in loaded if x.startswith('voteit.importparticipants'))},
+          sys.stdout)
+"""
+
+
+def measure_startup(mode = 'include', repeat = 3):
+    """ Time config.include of the package ('include'), or a scan of every module in
+        it ('scan'), in repeat fresh processes. Returns the fastest run, with the number
+        of modules that were imported, the top level packages they belong to and the
+        names of this package's modules among them.
+    """
+    runs = []
+    for n in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', _STARTUP_SCRIPT, mode])
+        runs.append(json.loads(output))
+    best = min(runs, key = lambda x: x['seconds'])
+    best['mode'] = mode
+    best['seconds'] = round(best['seconds'], 4)
+    return best
+
+
+def measure_hashing(count = 10000, processes = 4, hash_method = None):
+    """ Seconds to hash count passwords inline, and with a PasswordHasher of processes. """
+    from voteit.importparticipants.hashing import PasswordHasher
+    from voteit.importparticipants.hashing import get_password_hash_method
+    if hash_method is None:
+        hash_method = get_password_hash_method()
+    passwords = [u"password%s" % n for n in range(count)]
+    (result, inline, rss) = measure(lambda: [hash_method(x) for x in passwords])
+    hasher = PasswordHasher(processes, hash_method = hash_method)
+    try:
+        (result, pool, rss) = measure(hasher, passwords)
+    finally:
+        hasher.close()
+    return {'passwords': count,
+            'processes': processes,
+            'inline_seconds': round(inline, 4),
+            'pool_seconds': round(pool, 4)}
+
+
+def run(sizes = DEFAULT_SIZES, existing_users = 10000):
+    results = []
+    for rows in sizes:
+        bench = BenchmarkRun(rows, existing_users)
+        try:
+            results.extend(bench())
+        finally:
+            bench.close()
+    return {'created': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'existing_users': existing_users,
+            'results': results}
+
+
+def main(argv = sys.argv):
+    parser = argparse.ArgumentParser(description = "Benchmark participant import.")
+    parser.add_argument('--sizes', type = int, nargs = '+', default = DEFAULT_SIZES,
+                        help = "Roster sizes to run.")
+    parser.add_argument('--existing-users', type = int, default = 10000,
+                        help = "Number of users in the site before the import.")
+    parser.add_argument('--output', default = None,
+                        help = "Write json results to this file instead of stdout.")
+    parser.add_argument('--startup', action = 'store_true',
+                        help = "Also measure the time to include the package at startup.")
+    parser.add_argument('--hashing', action = 'store_true',
+                        help = "Also compare hashing passwords inline with a process pool.")
+    parser.add_argument('--hash-processes', type = int, default = 4,
+                        help = "Processes of the pool for --hashing.")
+    args = parser.parse_args(argv[1:])
+    data = run(sizes = args.sizes, existing_users = args.existing_users)
+    if args.startup:
+        data['startup'] = [measure_startup('include'), measure_startup('scan')]
+    if args.hashing:
+        data['hashing'] = measure_hashing(count = max(args.sizes), processes = args.hash_processes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent = 2)
+    else:
+        json.dump(data, sys.stdout, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
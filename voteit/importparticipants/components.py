@@ -6,6 +6,9 @@ from voteit.core.security import MANAGE_GROUPS
 from voteit.importparticipants import VoteITImportParticipants as _
 
 
+@view_action('participants_menu', 'sync_participants', title = _(u"Sync participants with roster"), link = "sync_participants", permission = MANAGE_GROUPS)
+@view_action('participants_menu', 'add_participants_multiple', title = _(u"Import participants to several meetings"), link = "add_participants_multiple", permission = MANAGE_GROUPS)
+@view_action('participants_menu', 'add_participants_file', title = _(u"Import participants from file"), link = "add_participants_file", permission = MANAGE_GROUPS)
 @view_action('participants_menu', 'add_participants', title = _(u"Import participants"), link = "add_participants", permission = MANAGE_GROUPS)
 def generic_menu_link(context, request, va, **kw):
     """ This is for simple menu items for the meeting root """
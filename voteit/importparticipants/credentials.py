@@ -0,0 +1,69 @@
+import os
+
+from zope.interface import implementer
+
+from voteit.importparticipants.interfaces import ICredentialGenerator
+
+
+_PW_CHARS = 'abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+PASSWORD_LENGTH_SETTING = 'voteit.importparticipants.password_length'
+PASSWORD_CHARS_SETTING = 'voteit.importparticipants.password_chars'
+
+
+@implementer(ICredentialGenerator)
+class CredentialGenerator(object):
+    """ Generates passwords from OS entropy. Random bytes for a whole batch are
+        read at once, and mapped to the alphabet with rejection sampling so every
+        character is equally likely.
+    """
+
+    def __init__(self, length = 10, alphabet = _PW_CHARS):
+        assert length > 0
+        assert 1 < len(alphabet) <= 256
+        self.length = length
+        self.alphabet = alphabet
+        # bytes at or above this value would make the first characters more likely
+        self.limit = 256 - (256 % len(alphabet))
+
+    def generate(self, count):
+        """ Return a list of count unique passwords. """
+        if count > len(self.alphabet) ** self.length:
+            raise ValueError("Can't generate %s unique passwords with length %s" % (count, self.length))
+        output = []
+        used = set()
+        while len(output) < count:
+            chars = self._random_chars((count - len(output)) * self.length)
+            for i in range(0, len(chars), self.length):
+                password = chars[i:i + self.length]
+                if password not in used:
+                    used.add(password)
+                    output.append(password)
+        return output
+
+    def _random_chars(self, needed):
+        alphabet = self.alphabet
+        size = len(alphabet)
+        limit = self.limit
+        chars = []
+        while len(chars) < needed:
+            # draw a bit more than needed so rejected bytes seldom require another read
+            missing = needed - len(chars)
+            data = os.urandom(missing * 256 // limit + 16)
+            chars.extend(alphabet[ord(x) % size] for x in data if ord(x) < limit)
+        return ''.join(chars[:needed])
+
+
+def get_credential_generator(registry):
+    """ Return the registered ICredentialGenerator, or one with default settings. """
+    generator = registry.queryUtility(ICredentialGenerator)
+    if generator is None:
+        generator = CredentialGenerator()
+    return generator
+
+
+def includeme(config):
+    settings = config.registry.settings or {}
+    generator = CredentialGenerator(length = int(settings.get(PASSWORD_LENGTH_SETTING, 10)),
+                                    alphabet = settings.get(PASSWORD_CHARS_SETTING, _PW_CHARS))
+    config.registry.registerUtility(generator, ICredentialGenerator)
@@ -0,0 +1,14 @@
+from zope.interface import implementer
+from betahaus.pyracont.events import ObjectUpdatedEvent
+
+from voteit.importparticipants.interfaces import IParticipantsImportedEvent
+
+
+@implementer(IParticipantsImportedEvent)
+class ParticipantsImportedEvent(ObjectUpdatedEvent):
+    """ See interfaces.IParticipantsImportedEvent """
+
+    def __init__(self, object, userids, roles):
+        super(ParticipantsImportedEvent, self).__init__(object)
+        self.userids = userids
+        self.roles = roles
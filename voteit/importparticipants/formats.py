@@ -0,0 +1,161 @@
+import csv
+import zipfile
+from xml.etree.cElementTree import iterparse
+
+from zope.interface import implementer
+
+from voteit.importparticipants.interfaces import IParticipantFormat
+from voteit.importparticipants.parsing import iter_participants
+from voteit.importparticipants.parsing import participants_from_rows
+
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+@implementer(IParticipantFormat)
+class CSVFormat(object):
+    """ Csv or tab separated text, with the delimiter detected from a sample. """
+
+    def __call__(self, fp):
+        try:
+            for participant in iter_participants(fp):
+                yield participant
+        except csv.Error, exc:
+            raise ValueError(str(exc))
+
+
+@implementer(IParticipantFormat)
+class XLSXFormat(object):
+    """ The first worksheet of an Excel 2007+ workbook. The sheet is read with
+        iterparse row by row, so only the shared strings of the workbook are kept
+        in memory.
+    """
+
+    def __call__(self, fp):
+        try:
+            archive = zipfile.ZipFile(fp)
+        except zipfile.BadZipfile, exc:
+            raise ValueError(str(exc))
+        try:
+            shared = read_shared_strings(archive)
+            for participant in participants_from_rows(iter_sheet_rows(archive, first_sheet(archive), shared)):
+                yield participant
+        except (KeyError, SyntaxError), exc:
+            # missing parts of the archive or broken xml
+            raise ValueError("Not a readable xlsx file: %s" % exc)
+        finally:
+            archive.close()
+
+
+def _text(elem):
+    return unicode(elem.text or u"")
+
+
+def column_index(ref):
+    """ Zero based column of a cell reference, so 'C5' is 2 and 'AA1' is 26. """
+    index = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord('A') + 1
+    return index - 1
+
+
+def first_sheet(archive):
+    """ Path of the first worksheet in the workbook, in the order of the sheet tabs. """
+    rels = {}
+    with archive.open('xl/_rels/workbook.xml.rels') as f:
+        for (event, elem) in iterparse(f):
+            if elem.tag == _PKG_REL_NS + 'Relationship':
+                rels[elem.get('Id')] = elem.get('Target')
+    with archive.open('xl/workbook.xml') as f:
+        for (event, elem) in iterparse(f):
+            if elem.tag == _NS + 'sheet':
+                target = rels[elem.get(_REL_NS + 'id')]
+                if target.startswith('/'):
+                    return target[1:]
+                return 'xl/' + target
+    raise KeyError("The workbook has no sheets")
+
+
+def read_shared_strings(archive):
+    """ Return the shared strings of the workbook as a list. """
+    output = []
+    try:
+        f = archive.open('xl/sharedStrings.xml')
+    except KeyError:
+        return output
+    with f:
+        for (event, elem) in iterparse(f):
+            if elem.tag != _NS + 'si':
+                continue
+            # plain text, or rich text runs. Phonetic hints (rPh) are skipped
+            parts = []
+            for child in elem:
+                if child.tag == _NS + 't':
+                    parts.append(_text(child))
+                elif child.tag == _NS + 'r':
+                    parts.extend(_text(x) for x in child.iter(_NS + 't'))
+            output.append(u"".join(parts))
+            elem.clear()
+    return output
+
+
+def _cell_value(cell, shared):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return u"".join(_text(x) for x in cell.iter(_NS + 't'))
+    value = cell.find(_NS + 'v')
+    if value is None:
+        return u""
+    if kind == 's':
+        return shared[int(value.text)]
+    if kind == 'b':
+        return value.text == '1' and u"TRUE" or u"FALSE"
+    return _text(value)
+
+
+def iter_sheet_rows(archive, path, shared):
+    """ Yield the rows of a worksheet as lists of unicode. Empty rows and cells
+        are filled in, so row numbers and columns match the spreadsheet.
+    """
+    with archive.open(path) as f:
+        row_number = 0
+        for (event, elem) in iterparse(f):
+            if elem.tag != _NS + 'row':
+                continue
+            number = int(elem.get('r', row_number + 1))
+            while row_number + 1 < number:
+                row_number += 1
+                yield []
+            values = []
+            for cell in elem.iter(_NS + 'c'):
+                ref = cell.get('r')
+                if ref:
+                    values.extend([u""] * (column_index(ref) - len(values)))
+                values.append(_cell_value(cell, shared))
+            row_number = number
+            elem.clear()
+            yield values
+
+
+_BUILTIN_FORMATS = {'csv': CSVFormat,
+                    'txt': CSVFormat,
+                    'tsv': CSVFormat,
+                    'xlsx': XLSXFormat}
+
+
+def get_participant_format(registry, filename = None):
+    """ Return the IParticipantFormat registered for the extension of filename.
+        Unknown extensions are read as csv.
+    """
+    extension = u""
+    if filename and '.' in filename:
+        extension = filename.rsplit('.', 1)[1].lower()
+    reader = registry.queryUtility(IParticipantFormat, name = extension)
+    if reader is None:
+        reader = _BUILTIN_FORMATS.get(extension, CSVFormat)()
+    return reader
+
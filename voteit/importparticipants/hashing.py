@@ -0,0 +1,86 @@
+from multiprocessing import Pool
+
+from voteit.importparticipants.interfaces import IPasswordHasher
+
+
+HASH_PROCESSES_SETTING = 'voteit.importparticipants.hash_processes'
+
+
+def get_hash_processes(registry):
+    """ Number of processes used to hash passwords of imported users, from the setting
+        voteit.importparticipants.hash_processes. 0, the default, means hash them one
+        at a time when each user is created. A pool only pays off for slow hash
+        methods, it's slower for the default one. Check with:
+        python -m voteit.importparticipants.benchmark --hashing
+    """
+    settings = registry.settings or {}
+    return int(settings.get(HASH_PROCESSES_SETTING, 0))
+
+
+def get_password_hash_method():
+    """ The hash method of the password field that users are created with. """
+    # imported here, since includeme runs before the content types are set up
+    from betahaus.pyracont.factories import createField
+    from voteit.core.models.user import User
+    return createField(User.custom_fields['password']).hash_method
+
+
+def set_prehashed_password(user, hashed, hash_method):
+    """ Store a password that has already been hashed with hash_method on user.
+        PasswordField has no setter for a hash, so it's stored where the field's
+        get and check_input read it. Raises ValueError if the password field of
+        user hashes with another method, since the password couldn't be checked.
+    """
+    field = user.get_custom_field('password')
+    if field.hash_method != hash_method:
+        raise ValueError("The password field of %r uses %r, not %r" % (user, field.hash_method, hash_method))
+    field.__encrypted_password__ = hashed
+
+
+def get_password_hasher(registry):
+    """ Return the registered IPasswordHasher, or None if passwords are hashed
+        when each user is created.
+    """
+    return registry.queryUtility(IPasswordHasher)
+
+
+class PasswordHasher(object):
+    """ Hashes batches of passwords in a pool of processes.
+        The pool is started when the hasher is created, since forking a process
+        that has threads with locks or database connections in use can deadlock.
+        It's shared by all imports, and can be shut down with close().
+    """
+
+    def __init__(self, processes, hash_method = None):
+        self.processes = processes
+        self._hash_method = hash_method
+        self.pool = Pool(processes)
+
+    @property
+    def hash_method(self):
+        """ Looked up on first use, since the password field isn't registered
+            when the hasher is created by includeme.
+        """
+        if self._hash_method is None:
+            self._hash_method = get_password_hash_method()
+        return self._hash_method
+
+    def __call__(self, passwords):
+        """ Return a list of hashes, in the same order as passwords. """
+        chunksize = max(1, len(passwords) // (self.processes * 4))
+        return self.pool.map(self.hash_method, passwords, chunksize)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def includeme(config):
+    """ Start the pool while the application is configured, before the server
+        or import jobs have started any threads.
+    """
+    processes = get_hash_processes(config.registry)
+    if processes:
+        config.registry.registerUtility(PasswordHasher(processes), IPasswordHasher)
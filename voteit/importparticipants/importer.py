@@ -0,0 +1,273 @@
+import logging
+from datetime import datetime
+from hashlib import sha1
+from itertools import islice
+from itertools import izip
+from time import time
+
+import transaction
+from pyramid.settings import asbool
+from pyramid.traversal import find_root
+from pyramid.traversal import resource_path
+from zope.component.event import objectEventNotify
+from repoze.folder.events import ObjectAddedEvent
+from repoze.folder.events import ObjectWillBeAddedEvent
+from betahaus.pyracont.factories import createContent
+
+from voteit.importparticipants.credentials import CredentialGenerator
+from voteit.importparticipants.events import ParticipantsImportedEvent
+from voteit.importparticipants.hashing import set_prehashed_password
+from voteit.importparticipants.instrumentation import get_instrumentation
+from voteit.importparticipants.userids import UseridAllocator
+
+
+CHUNK_SIZE_SETTING = 'voteit.importparticipants.chunk_size'
+DEFER_INDEXING_SETTING = 'voteit.importparticipants.defer_indexing'
+
+log = logging.getLogger(__name__)
+
+
+def get_chunk_size(registry):
+    """ Number of rows per commit for chunked imports, from the setting
+        voteit.importparticipants.chunk_size. 0 means import in a single transaction.
+    """
+    settings = registry.settings or {}
+    return int(settings.get(CHUNK_SIZE_SETTING, 0))
+
+
+def get_defer_indexing(registry):
+    """ If the setting voteit.importparticipants.defer_indexing is true, new users
+        are indexed in bulk after each batch instead of when they're added.
+    """
+    settings = registry.settings or {}
+    return asbool(settings.get(DEFER_INDEXING_SETTING, False))
+
+
+def participants_digest(participants):
+    """ Return a hex digest of the participant rows, used to recognize the same
+        input when an import is resubmitted. Values are stripped and emails
+        lowercased first, so formatting differences don't matter.
+    """
+    digest = sha1()
+    for participant in participants:
+        values = [x.strip() for x in participant.values()]
+        # email
+        values[2] = values[2].lower()
+        digest.update(u"\x1f".join(values).encode('UTF-8'))
+        digest.update("\n")
+    return digest.hexdigest()
+
+
+def import_key(meeting, roles, digest):
+    """ Key of an import of input with digest into meeting with roles. """
+    key = sha1(resource_path(meeting))
+    key.update("\x1f" + u",".join(sorted(roles)).encode('UTF-8'))
+    key.update("\x1f" + digest)
+    return key.hexdigest()
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ParticipantImporter(object):
+    """ Creates users from Participant records and adds them to a meeting
+        with the specified roles. Rows are handled in batches of batch_size.
+        Missing passwords of a batch are created with one call to generate_passwords,
+        which should accept a count and return that many passwords.
+        Participants get the roles of their roles column, or roles if it's empty.
+        meetings may contain more (meeting, roles) pairs, the users are created once
+        and added to all of them the same way.
+        Roles are added without events for each user, instead one
+        ParticipantsImportedEvent is sent for each batch, meeting and set of roles.
+
+        If defer_indexing is true, the object added event of each user, which
+        indexes it in the catalog, is sent after each batch has been written
+        instead of when the user is added. The object will be added event is
+        still sent right away, so no subscribers are skipped.
+
+        If hasher is a PasswordHasher, the passwords of each batch are hashed in
+        its pool of processes before the users are created.
+
+        Time spent is collected in timings, with one key per phase. When an import is
+        done, the timings are emitted to instrumentation.
+    """
+    batch_size = 500
+
+    def __init__(self, meeting, roles, generate_passwords = None, defer_indexing = False,
+                 hasher = None, instrumentation = None, meetings = ()):
+        self.meeting = meeting
+        self.root = find_root(meeting)
+        self.users = self.root.users
+        self.roles = roles
+        self.targets = [(meeting, tuple(roles))]
+        self.targets.extend((obj, tuple(obj_roles)) for (obj, obj_roles) in meetings)
+        if generate_passwords is None:
+            generate_passwords = CredentialGenerator().generate
+        self.generate_passwords = generate_passwords
+        self.defer_indexing = defer_indexing
+        self.hasher = hasher
+        self.allocator = None
+        self.pending_userids = {}
+        self.pending_index = []
+        self.instrumentation = instrumentation
+        self.count = 0
+        self.timings = {'hash': 0.0, 'userid': 0.0, 'create': 0.0, 'groups': 0.0, 'index': 0.0, 'events': 0.0}
+
+    def __call__(self, participants):
+        """ Import all participants. Returns a list of the records, updated with
+            the final userid and password.
+        """
+        output = []
+        for batch in _batches(participants, self.batch_size):
+            self.import_batch(batch)
+            output.extend(batch)
+        self.index_pending()
+        self.notify_imported()
+        self.report_timings()
+        return output
+
+    def import_batch(self, batch):
+        """ Import a list of participants. Passwords are hashed for the whole batch
+            first if there's a hasher.
+        """
+        missing = [x for x in batch if not x.password]
+        if missing:
+            for (participant, password) in izip(missing, self.generate_passwords(len(missing))):
+                participant.password = password
+        userids = self.allocate_userids([x.userid for x in batch])
+        if self.hasher is None:
+            for (participant, userid) in izip(batch, userids):
+                self.import_participant(participant, userid = userid)
+            return
+        start = time()
+        hashes = self.hasher([x.password for x in batch])
+        self.timings['hash'] += time() - start
+        for (participant, userid, hashed) in izip(batch, userids, hashes):
+            self.import_participant(participant, userid = userid, hashed = hashed)
+
+    def allocate_userids(self, requested):
+        """ Return unique userids for the requested ones. The existing userids are
+            read the first time this is called, and the allocator keeps track of
+            the ones given out since.
+        """
+        start = time()
+        if self.allocator is None:
+            self.allocator = UseridAllocator(self.users)
+        userids = self.allocator(requested)
+        self.timings['userid'] += time() - start
+        return userids
+
+    def import_participant(self, participant, userid = None, hashed = None):
+        """ Create one user. userid should come from allocate_userids, if it's not
+            given it will be allocated. If hashed is given, it's stored as the users
+            password hash instead of hashing the password of the participant.
+        """
+        if not participant.password:
+            participant.password = self.generate_passwords(1)[0]
+        if userid is None:
+            userid = self.allocate_userids([participant.userid])[0]
+
+        # add user to root
+        start = time()
+        kwargs = dict(creators = [userid],
+                      email = participant.email,
+                      first_name = participant.first_name,
+                      last_name = participant.last_name)
+        if hashed is None:
+            kwargs['password'] = participant.password
+        user = createContent('User', **kwargs)
+        if hashed is not None:
+            set_prehashed_password(user, hashed, self.hasher.hash_method)
+        if self.defer_indexing:
+            objectEventNotify(ObjectWillBeAddedEvent(user, self.users, userid))
+            self.users.add(userid, user, send_events = False)
+            self.pending_index.append(user)
+        else:
+            self.users[userid] = user
+        self.timings['create'] += time() - start
+
+        # add user to meeting, the event is sent by notify_imported
+        start = time()
+        for (i, (meeting, default_roles)) in enumerate(self.targets):
+            roles = participant.get_roles(default_roles)
+            meeting.add_groups(userid, roles, event = False)
+            self.pending_userids.setdefault((i, roles), []).append(userid)
+        self.timings['groups'] += time() - start
+
+        participant.userid = userid
+        self.count += 1
+        return participant
+
+    def index_pending(self):
+        """ Send the object added events of the users that were added with deferred
+            indexing since the last call. The subscribers of that event index them.
+        """
+        if not self.pending_index:
+            return
+        start = time()
+        for user in self.pending_index:
+            objectEventNotify(ObjectAddedEvent(user, self.users, user.__name__))
+        count = len(self.pending_index)
+        self.pending_index = []
+        elapsed = time() - start
+        self.timings['index'] += elapsed
+        log.info("Indexed %s imported users in %.2fs", count, elapsed)
+
+    def notify_imported(self):
+        """ Send one ParticipantsImportedEvent for each meeting and set of roles given
+            to the users imported since the last call.
+        """
+        if not self.pending_userids:
+            return
+        start = time()
+        pending = self.pending_userids
+        self.pending_userids = {}
+        for ((i, roles), userids) in sorted(pending.items()):
+            objectEventNotify(ParticipantsImportedEvent(self.targets[i][0], tuple(userids), roles))
+        self.timings['events'] += time() - start
+
+    def report_timings(self):
+        """ Emit the time spent in each phase to instrumentation. """
+        instrumentation = self.instrumentation
+        if instrumentation is None:
+            instrumentation = get_instrumentation()
+        for (phase, seconds) in sorted(self.timings.items()):
+            instrumentation.emit(phase, seconds, rows = self.count)
+
+    def import_chunked(self, participants, progress, chunk_size, commit = transaction.commit, results = None):
+        """ Import participants and call commit every chunk_size rows. If chunk_size
+            is 0, rows are imported in batches of batch_size without any commits.
+            progress is an ImportProgress, which gets the result of each batch, so no
+            list of all rows is kept. If results is given, the imported participants
+            are passed to its add method instead, like when they're sent to the caller
+            and shouldn't be stored. The cursor of progress is moved in the same
+            transaction as the rows of each chunk, so if an import is aborted it can be
+            run again with the same input and progress: rows before the cursor are skipped.
+            The remaining rows after the last full chunk are left to the surrounding
+            transaction. Returns progress.
+        """
+        size = chunk_size or self.batch_size
+        if results is None:
+            results = progress
+        rows = iter(participants)
+        # skip rows that were committed by an earlier attempt
+        row = sum(1 for x in islice(rows, progress.cursor))
+        for batch in _batches(rows, size):
+            self.import_batch(batch)
+            for participant in batch:
+                results.add(participant)
+            row += len(batch)
+            self.index_pending()
+            self.notify_imported()
+            progress.cursor = row
+            progress.updated = datetime.utcnow()
+            if chunk_size and len(batch) == chunk_size:
+                commit()
+        self.report_timings()
+        return progress
@@ -0,0 +1,68 @@
+import logging
+from contextlib import contextmanager
+from time import time
+
+from pyramid.threadlocal import get_current_registry
+from zope.interface import implementer
+
+from voteit.importparticipants.interfaces import IImportInstrumentation
+
+
+log = logging.getLogger(__name__)
+
+
+@implementer(IImportInstrumentation)
+class ImportInstrumentation(object):
+    """ Passes timings of the phases of an import on to subscribers.
+        A subscriber is a callable that accepts a dict with at least the keys
+        phase, seconds and rows.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def emit(self, phase, seconds, rows = None, **info):
+        if not self.subscribers:
+            return
+        record = dict(info, phase = phase, seconds = seconds, rows = rows)
+        for subscriber in self.subscribers:
+            subscriber(record)
+
+    @contextmanager
+    def phase(self, name, rows = None, **info):
+        """ Time the code in the with statement. The yielded dict is emitted
+            with the timing, so rows can be set on it when they're known.
+        """
+        record = dict(info, rows = rows)
+        start = time()
+        try:
+            yield record
+        finally:
+            self.emit(name, time() - start, **record)
+
+
+def log_phase(record):
+    """ Default subscriber that writes every phase to the log. """
+    log.info("Participant import phase %s took %.3fs for %s rows",
+             record['phase'], record['seconds'], record['rows'])
+
+
+def get_instrumentation(registry = None):
+    """ Return the registered IImportInstrumentation. If there isn't one, a new one
+        without subscribers is returned.
+    """
+    if registry is None:
+        registry = get_current_registry()
+    instrumentation = registry.queryUtility(IImportInstrumentation)
+    if instrumentation is None:
+        instrumentation = ImportInstrumentation()
+    return instrumentation
+
+
+def includeme(config):
+    instrumentation = ImportInstrumentation()
+    instrumentation.subscribe(log_phase)
+    config.registry.registerUtility(instrumentation, IImportInstrumentation)
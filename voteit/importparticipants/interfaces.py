@@ -0,0 +1,88 @@
+from zope.interface import Attribute
+from zope.interface import Interface
+
+from betahaus.pyracont.interfaces import IObjectUpdatedEvent
+
+
+class IParticipantsImportedEvent(IObjectUpdatedEvent):
+    """ Sent once for a batch of imported participants, after their roles have been
+        added to the meeting. Since it's an object updated event for the meeting,
+        subscribers that reindex updated objects will handle the meeting once for
+        the whole batch.
+    """
+    userids = Attribute("Userids of the participants that were imported.")
+    roles = Attribute("Roles the participants were given.")
+
+
+class IImportJobs(Interface):
+    """ Utility that runs participant imports in the background. """
+
+    def add(job):
+        """ Queue a callable job. """
+
+    def add_after_commit(job):
+        """ Queue a callable job when the current transaction has been committed. """
+
+    def is_pending(key):
+        """ True if a job for the import with key is queued or running in this process. """
+
+
+class ICredentialGenerator(Interface):
+    """ Utility that generates passwords for imported participants. """
+
+    def generate(count):
+        """ Return a list of count unique passwords. """
+
+
+class ICredentialMailer(Interface):
+    """ Utility that emails imported participants their userid and password. """
+
+    available = Attribute("True if there's a configured mailer to send with.")
+    queued = Attribute("True if the mailer has a maildir queue, so queue can be used.")
+
+    def queue(mail):
+        """ Add the messages of a CredentialMail to the maildir queue of the mailer
+            when the current transaction is committed.
+        """
+
+    def deliver(mail):
+        """ Send a CredentialMail right away. Returns the number of failed messages. """
+
+
+class IPasswordHasher(Interface):
+    """ Utility that hashes the passwords of imported participants in a pool of
+        processes that's started with the application.
+    """
+
+    hash_method = Attribute("The hash method of the password field of users.")
+
+    def __call__(passwords):
+        """ Return a list of hashes, in the same order as passwords. """
+
+
+class IImportInstrumentation(Interface):
+    """ Utility that receives timings and row counts for the phases of imports.
+        Other code can subscribe to it to see where time is spent.
+    """
+
+    def subscribe(subscriber):
+        """ Add a callable that will be called with a dict for each phase,
+            with at least the keys phase, seconds and rows.
+        """
+
+    def emit(phase, seconds, rows = None, **info):
+        """ Pass a timing on to all subscribers. """
+
+    def phase(name, rows = None, **info):
+        """ Context manager that emits the time spent within it. """
+
+
+class IParticipantFormat(Interface):
+    """ Utility that reads participant records from a file in some format.
+        Registered with the file extension it handles as name.
+    """
+
+    def __call__(fp):
+        """ Yield Participant records from the file-like object fp. Raises ValueError
+            if the file can't be read.
+        """
@@ -0,0 +1,154 @@
+import logging
+from datetime import datetime
+from datetime import timedelta
+from Queue import Queue
+from threading import Lock
+from threading import Thread
+
+import transaction
+from pyramid.request import Request
+from pyramid.threadlocal import manager
+from zope.interface import implementer
+
+from voteit.importparticipants.credentials import get_credential_generator
+from voteit.importparticipants.interfaces import IImportJobs
+
+
+BACKGROUND_THRESHOLD_SETTING = 'voteit.importparticipants.background_threshold'
+BACKGROUND_CHUNK_SIZE = 100
+#: A queued import without progress for this long is considered lost, see ImportProgress.is_stale
+STALE_JOB_AFTER = timedelta(minutes = 10)
+
+log = logging.getLogger(__name__)
+
+
+def get_background_threshold(registry):
+    """ Imports with more rows than the setting voteit.importparticipants.background_threshold
+        are run as background jobs. 0 means never.
+    """
+    settings = registry.settings or {}
+    return int(settings.get(BACKGROUND_THRESHOLD_SETTING, 0))
+
+
+class ImportJob(object):
+    """ Runs a participant import in its own ZODB connection.
+        Progress, errors and results are stored in the ImportProgress with key
+        on the meeting, and committed every chunk_size rows. If the import fails,
+        the error is recorded and the progress is left unfinished and not queued,
+        so it can be resumed.
+        If mail is a CredentialMail, the imported participants are added to it and
+        it's written to the mail queue when the import is done.
+    """
+
+    def __init__(self, registry, db, meeting_oid, key, participants, roles,
+                 chunk_size = BACKGROUND_CHUNK_SIZE, defer_indexing = False, mail = None):
+        self.registry = registry
+        self.db = db
+        self.meeting_oid = meeting_oid
+        self.key = key
+        self.participants = participants
+        self.roles = roles
+        self.chunk_size = chunk_size
+        self.defer_indexing = defer_indexing
+        self.mail = mail
+
+    def __call__(self):
+        # imported here so including the package doesn't load the models, the
+        # importer or pyramid_mailer
+        from voteit.importparticipants.importer import ParticipantImporter
+        from voteit.importparticipants.hashing import get_password_hasher
+        from voteit.importparticipants.mailing import get_credential_mailer
+        from voteit.importparticipants.models import get_import_progress
+        tm = transaction.TransactionManager()
+        conn = self.db.open(transaction_manager = tm)
+        request = Request.blank('/')
+        request.registry = self.registry
+        manager.push({'registry': self.registry, 'request': request})
+        try:
+            meeting = conn.get(self.meeting_oid)
+            progress = get_import_progress(meeting, self.key)
+            progress.started = datetime.utcnow()
+            tm.commit()
+            importer = ParticipantImporter(meeting, self.roles,
+                                           generate_passwords = get_credential_generator(self.registry).generate,
+                                           defer_indexing = self.defer_indexing,
+                                           hasher = get_password_hasher(self.registry))
+            try:
+                importer.import_chunked(self.participants, progress, self.chunk_size, commit = tm.commit)
+            except Exception, exc:
+                tm.abort()
+                log.exception("Background import %s failed", self.key)
+                # The rows before the cursor have been committed. The record isn't
+                # finished, so submitting the same input again resumes after them.
+                progress.add_error(unicode(exc))
+                progress.queued = None
+                tm.commit()
+                return
+            progress.finished = datetime.utcnow()
+            tm.commit()
+            mailer = get_credential_mailer(self.registry)
+            if self.mail is not None and mailer is not None:
+                self.mail.add(progress.iter_participants())
+                # the mail queue joins the default transaction of this thread
+                try:
+                    mailer.queue(self.mail)
+                    transaction.commit()
+                finally:
+                    transaction.abort()
+        finally:
+            manager.pop()
+            tm.abort()
+            conn.close()
+
+
+@implementer(IImportJobs)
+class ImportJobs(object):
+    """ Queue of import jobs, handled one at a time by a worker thread in this process.
+        The keys of jobs that are queued or running are kept, so a lost job can be
+        told apart from one that's waiting.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.worker = None
+        self.pending = set()
+        self._lock = Lock()
+
+    def add(self, job):
+        with self._lock:
+            self.pending.add(getattr(job, 'key', None))
+        self.queue.put(job)
+        with self._lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = Thread(target = self._work, name = 'voteit.importparticipants')
+                self.worker.daemon = True
+                self.worker.start()
+
+    def add_after_commit(self, job):
+        """ Queue job when the current transaction has been committed,
+            so the job will see what the request stored.
+        """
+        def _hook(status):
+            if status:
+                self.add(job)
+        transaction.get().addAfterCommitHook(_hook)
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self.pending
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                job()
+            except Exception:
+                log.exception("Import job failed")
+            finally:
+                with self._lock:
+                    self.pending.discard(getattr(job, 'key', None))
+                self.queue.task_done()
+
+
+def includeme(config):
+    config.registry.registerUtility(ImportJobs(), IImportJobs)
@@ -0,0 +1,198 @@
+import logging
+from collections import deque
+from string import Template
+from time import sleep
+from time import time
+
+from pyramid.i18n import get_localizer
+from pyramid.url import resource_url
+from zope.interface import implementer
+
+from voteit.importparticipants import VoteITImportParticipants as _
+from voteit.importparticipants.interfaces import ICredentialMailer
+
+
+MAIL_PER_MINUTE_SETTING = 'voteit.importparticipants.mail_per_minute'
+MAIL_RETRIES_SETTING = 'voteit.importparticipants.mail_retries'
+MAIL_BATCH_SIZE_SETTING = 'voteit.importparticipants.mail_batch_size'
+
+log = logging.getLogger(__name__)
+
+
+class CredentialMail(object):
+    """ Credential emails for a list of imported participants.
+        subject and body are translated texts where ${userid}, ${password},
+        ${first_name}, ${last_name} and ${url} are replaced for each recipient.
+        Participants without email are skipped.
+    """
+
+    def __init__(self, subject, body, url, participants = (), sender = None):
+        self.subject = subject
+        self.body = body
+        self.url = url
+        self.sender = sender
+        self.recipients = []
+        self.add(participants)
+
+    def add(self, participants):
+        self.recipients.extend((x.email, x.userid, x.password, x.first_name, x.last_name)
+                               for x in participants if x.email)
+
+    def iter_batches(self, size):
+        """ Yield lists of at most size Messages. """
+        for i in range(0, len(self.recipients), size):
+            yield [self.build(x) for x in self.recipients[i:i + size]]
+
+    def build(self, recipient):
+        # pyramid_mailer is imported when mail is sent, not when the package is included
+        from pyramid_mailer.message import Message
+        (email, userid, password, first_name, last_name) = recipient
+        mapping = dict(userid = userid, password = password, first_name = first_name,
+                       last_name = last_name, url = self.url)
+        return Message(subject = Template(self.subject).safe_substitute(mapping),
+                       sender = self.sender,
+                       recipients = [email],
+                       body = Template(self.body).safe_substitute(mapping))
+
+
+def credential_mail(request, meeting, participants = ()):
+    """ Return a CredentialMail for participants of meeting, with the texts
+        translated for request.
+    """
+    localizer = get_localizer(request)
+    subject = localizer.translate(_(u"credentials_mail_subject",
+                                    default = u"Your account for ${meeting}",
+                                    mapping = {'meeting': meeting.title}))
+    body = localizer.translate(_(u"credentials_mail_body",
+                                 default = u"Hello ${first_name}\n\n"
+                                           u"You've been added as a participant in ${meeting}. "
+                                           u"Log in at ${url} with:\n\n"
+                                           u"UserID: ${userid}\n"
+                                           u"Password: ${password}\n\n"
+                                           u"Please change your password once you've logged in.",
+                                 mapping = {'meeting': meeting.title}))
+    return CredentialMail(subject, body, resource_url(meeting, request), participants)
+
+
+@implementer(ICredentialMailer)
+class CredentialMailer(object):
+    """ Sends credential emails with mailer, or the pyramid_mailer mailer of registry.
+        Messages are built batch_size at a time.
+
+        queue adds them to the maildir queue of the mailer, from the setting
+        mail.queue_path, in the current transaction. They're only written if it's
+        committed, so nothing is sent for users that were never created, and they're
+        kept on disk until the queue processor of repoze.sendmail (qp) has sent them.
+        It retries messages that fail and keeps the ones that are rejected, so a
+        restart doesn't lose anything.
+
+        deliver sends them right away instead, for the console script. At most
+        per_minute are sent every minute, and a message that fails is retried up to
+        retries times with a growing delay.
+    """
+    retry_delay = 10
+
+    def __init__(self, mailer = None, registry = None, per_minute = 60, retries = 3, batch_size = 100):
+        self._mailer = mailer
+        self.registry = registry
+        self.per_minute = per_minute
+        self.retries = retries
+        self.batch_size = batch_size
+        self.sent = deque()
+        # replaceable for tests
+        self.time = time
+        self.sleep = sleep
+
+    @property
+    def mailer(self):
+        if self._mailer is None:
+            from pyramid_mailer import get_mailer
+            self._mailer = get_mailer(self.registry)
+        return self._mailer
+
+    @property
+    def available(self):
+        """ True if there's a mailer to send with. Without one, pyramid_mailer
+            hasn't been included and every message would fail.
+        """
+        from pyramid_mailer.interfaces import IMailer
+        return self._mailer is not None or \
+            (self.registry is not None and self.registry.queryUtility(IMailer) is not None)
+
+    @property
+    def queued(self):
+        """ True if the mailer has a maildir queue, so queue can be used. """
+        # the DummyMailer of pyramid_mailer's testing setup has no queue_delivery,
+        # but queues messages in memory
+        return self.available and getattr(self.mailer, 'queue_delivery', True) is not None
+
+    def queue(self, mail):
+        """ Add the messages of mail to the maildir queue when the current transaction
+            is committed.
+        """
+        count = 0
+        for batch in mail.iter_batches(self.batch_size):
+            for message in batch:
+                self.mailer.send_to_queue(message)
+            count += len(batch)
+        log.info("Queued %s credential emails", count)
+
+    def deliver(self, mail):
+        """ Send all messages of mail. Returns the number of messages that couldn't be sent. """
+        if not self.available:
+            log.error("No mailer is configured, %s credential emails weren't sent", len(mail.recipients))
+            return len(mail.recipients)
+        failed = 0
+        for batch in mail.iter_batches(self.batch_size):
+            for message in batch:
+                if not self.send(message):
+                    failed += 1
+        return failed
+
+    def send(self, message):
+        """ Send message, with retries. Returns False if it couldn't be sent. """
+        for attempt in range(self.retries + 1):
+            self.wait_for_rate()
+            try:
+                self.mailer.send_immediately(message, fail_silently = False)
+                return True
+            except Exception:
+                log.warning("Sending credentials to %s failed, attempt %s",
+                            message.recipients, attempt + 1, exc_info = True)
+                if attempt < self.retries:
+                    self.sleep(self.retry_delay * (attempt + 1))
+        log.error("Couldn't send credentials to %s", message.recipients)
+        return False
+
+    def wait_for_rate(self):
+        """ Sleep until another message may be sent within per_minute. """
+        if not self.per_minute:
+            return
+        now = self.time()
+        while self.sent and now - self.sent[0] >= 60:
+            self.sent.popleft()
+        if len(self.sent) >= self.per_minute:
+            self.sleep(60 - (now - self.sent[0]))
+            self.sent.popleft()
+            now = self.time()
+        self.sent.append(now)
+
+
+def get_credential_mailer(registry, queued = True):
+    """ Return the registered ICredentialMailer, or None if mail isn't configured,
+        which is when it has no mailer to send with, or if queued is true, when
+        the mailer has no maildir queue.
+    """
+    mailer = registry.queryUtility(ICredentialMailer)
+    if mailer is None or not mailer.available or (queued and not mailer.queued):
+        return None
+    return mailer
+
+
+def includeme(config):
+    settings = config.registry.settings or {}
+    mailer = CredentialMailer(registry = config.registry,
+                              per_minute = int(settings.get(MAIL_PER_MINUTE_SETTING, 60)),
+                              retries = int(settings.get(MAIL_RETRIES_SETTING, 3)),
+                              batch_size = int(settings.get(MAIL_BATCH_SIZE_SETTING, 100)))
+    config.registry.registerUtility(mailer, ICredentialMailer)
@@ -0,0 +1,273 @@
+import csv
+import os
+from datetime import datetime
+from datetime import timedelta
+from itertools import islice
+from tempfile import gettempdir
+from uuid import uuid4
+
+from BTrees.IOBTree import IOBTree
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from persistent.list import PersistentList
+
+from voteit.importparticipants.parsing import Participant
+from voteit.importparticipants.parsing import write_csv
+
+
+RESULT_MAX_AGE_SETTING = 'voteit.importparticipants.result_max_age'
+RESULT_DIR_SETTING = 'voteit.importparticipants.result_dir'
+
+
+class ImportProgress(Persistent):
+    """ Progress of a participant import, stored on the meeting with a key from
+        importer.import_key, so a retry of the same import finds it.
+        cursor is the number of rows that have been committed. The imported
+        participants, including generated passwords, are written to the csv
+        file result_path if spool_results has been called, so they never end
+        up in the database. Otherwise they're kept in results, an IOBTree keyed
+        by position, so a commit after each chunk only writes the buckets that
+        got new rows. result_count is the number of results. Either way they're
+        removed by clear_results when they expire.
+        digest is the participants_digest of the input.
+        queued is set when a background job has been queued. started, finished
+        and errors are set by background jobs and by imports in a request. An
+        import that fails gets an error, clears queued and leaves finished
+        unset. updated is set each time a batch has been imported.
+    """
+    digest = None
+    queued = None
+    started = None
+    updated = None
+    finished = None
+    cleared = False
+    errors = ()
+    result_count = 0
+    result_path = None
+    result_size = 0
+
+    def __init__(self, key, total = None, digest = None):
+        self.key = key
+        self.total = total
+        self.digest = digest
+        self.cursor = 0
+        self.results = IOBTree()
+        self.created = datetime.utcnow()
+
+    def spool_results(self, result_dir):
+        """ Write the results to a new file in result_dir instead of the database,
+            unless they're already written somewhere.
+        """
+        if self.result_path is None and not self.result_count:
+            self.result_path = os.path.join(result_dir, "%s.csv" % uuid4().hex)
+
+    def add(self, participant):
+        if self.result_path is None:
+            self.results[self.result_count] = participant.values()
+        else:
+            fp = self._result_file()
+            write_csv(fp, [participant])
+            fp.flush()
+            self.result_size = fp.tell()
+        self.result_count += 1
+
+    def _result_file(self):
+        """ The file at result_path, positioned at its end. Rows after result_size
+            were written by a transaction that was aborted, and are truncated.
+        """
+        fp = getattr(self, '_v_result_file', None)
+        if fp is None:
+            fd = os.open(self.result_path, os.O_RDWR | os.O_CREAT, 0600)
+            fp = self._v_result_file = os.fdopen(fd, 'r+b')
+        fp.seek(0, os.SEEK_END)
+        if fp.tell() > self.result_size:
+            fp.seek(self.result_size)
+            fp.truncate()
+        return fp
+
+    def add_error(self, error):
+        if not self.errors:
+            self.errors = PersistentList()
+        self.errors.append(error)
+
+    def eta(self, now = None):
+        """ Estimated seconds left, based on the rate so far. None if it can't be estimated yet. """
+        if self.finished:
+            return 0
+        if not self.started or not self.cursor or not self.total:
+            return None
+        if now is None:
+            now = datetime.utcnow()
+        elapsed = now - self.started
+        elapsed = elapsed.days * 86400 + elapsed.seconds + elapsed.microseconds / 1000000.0
+        return int(elapsed / self.cursor * (self.total - self.cursor))
+
+    def is_stale(self, max_idle, now = None):
+        """ True if nothing has happened to an unfinished import for max_idle, which
+            means it's no longer running, like when the server was restarted.
+            The latest of created, queued, started and updated counts, so a job
+            that has just been queued again isn't stale.
+        """
+        if now is None:
+            now = datetime.utcnow()
+        return now - self.last_activity() > max_idle
+
+    def last_activity(self):
+        """ The latest of created, queued, started, updated and finished. """
+        return max(x for x in (self.created, self.queued, self.started, self.updated, self.finished)
+                   if x is not None)
+
+    @property
+    def failed(self):
+        """ True if the import stopped with errors before it was done. """
+        return bool(self.errors) and not self.finished and not self.queued
+
+    def as_dict(self):
+        """ Status suitable for json. """
+        return {'key': self.key,
+                'total': self.total,
+                'processed': self.cursor,
+                'errors': list(self.errors),
+                'eta': self.eta(),
+                'finished': self.finished is not None,
+                'failed': self.failed}
+
+    def clear_results(self):
+        """ Forget the results, since they contain passwords. The record is kept so
+            a retry of the import can be recognized.
+        """
+        if self.result_path is not None:
+            fp = getattr(self, '_v_result_file', None)
+            if fp is not None:
+                fp.close()
+                del self._v_result_file
+            if os.path.exists(self.result_path):
+                os.remove(self.result_path)
+            self.result_path = None
+            self.result_size = 0
+        self.results = IOBTree()
+        self.result_count = 0
+        self.cleared = True
+
+    def get_participants(self, limit = None):
+        return list(islice(self.iter_participants(), limit))
+
+    def iter_participants(self):
+        if self.result_path is None:
+            for values in self.results.values():
+                yield Participant(*values)
+            return
+        # the file is missing if it's been spooled by a server on another host
+        if not os.path.exists(self.result_path):
+            return
+        with open(self.result_path, 'rb') as fp:
+            for values in csv.reader(fp, delimiter = ';', quotechar = '"'):
+                yield Participant(*[x.decode('UTF-8') for x in values])
+
+
+def get_result_max_age(registry):
+    """ Results of finished imports are forgotten after this many hours, from the setting
+        voteit.importparticipants.result_max_age. Returns a timedelta.
+    """
+    settings = registry.settings or {}
+    return timedelta(hours = int(settings.get(RESULT_MAX_AGE_SETTING, 24)))
+
+
+def get_result_dir(registry):
+    """ Directory where results of imports are written until they expire, from the
+        setting voteit.importparticipants.result_dir, or a directory in the system's
+        temporary directory. All processes of the site should use the same one.
+        It's created if it doesn't exist.
+    """
+    settings = registry.settings or {}
+    path = settings.get(RESULT_DIR_SETTING) or os.path.join(gettempdir(), 'voteit.importparticipants')
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path, 0700)
+        except OSError:
+            # created by another process
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def _progress_storage(meeting, create = False):
+    storage = getattr(meeting, '__participant_imports__', None)
+    if storage is None and create:
+        storage = meeting.__participant_imports__ = OOBTree()
+    return storage
+
+
+def has_import_progress(meeting):
+    """ True if any imports have been recorded for this meeting. """
+    return bool(_progress_storage(meeting))
+
+
+def find_import_progress(meeting, digest):
+    """ Return the ImportProgress for input with digest, regardless of roles,
+        or None if there isn't one.
+    """
+    storage = _progress_storage(meeting)
+    if not storage:
+        return None
+    for progress in storage.values():
+        if progress.digest == digest:
+            return progress
+
+
+def get_import_progress(meeting, key, create = False, **kw):
+    """ Return the ImportProgress for key, or None if there isn't one.
+        If create is True, a new one will be added if needed. kw is passed to
+        the ImportProgress constructor.
+    """
+    storage = _progress_storage(meeting, create = create)
+    if storage is None:
+        return None
+    progress = storage.get(key)
+    if progress is None and create:
+        progress = storage[key] = ImportProgress(key, **kw)
+    return progress
+
+
+def store_import_result(meeting, key, participants, digest = None, result_dir = None):
+    """ Keep the result of an import that's already done, so it can be downloaded later.
+        If result_dir is given, the result is written to a file there, see
+        ImportProgress.spool_results.
+    """
+    progress = get_import_progress(meeting, key, create = True, total = len(participants), digest = digest)
+    if result_dir is not None:
+        progress.spool_results(result_dir)
+    for participant in participants:
+        progress.add(participant)
+    progress.cursor = len(participants)
+    progress.finished = datetime.utcnow()
+    return progress
+
+
+def expire_import_results(meeting, max_age, now = None):
+    """ Forget the results of imports that finished more than max_age ago, or that
+        haven't been active for max_age without finishing, since they contain
+        passwords. Records without a digest are removed, the others are kept without
+        results so a retry is still recognized, and an unfinished import can still
+        be resumed. Returns the number of records that expired.
+    """
+    storage = _progress_storage(meeting)
+    if not storage:
+        return 0
+    if now is None:
+        now = datetime.utcnow()
+    count = 0
+    for (key, progress) in list(storage.items()):
+        if progress.cleared or now - (progress.finished or progress.last_activity()) < max_age:
+            continue
+        progress.clear_results()
+        if progress.digest is None:
+            del storage[key]
+        count += 1
+    return count
+
+
+def remove_import_progress(meeting, key):
+    storage = _progress_storage(meeting)
+    if storage is not None and key in storage:
+        del storage[key]
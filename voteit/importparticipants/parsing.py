@@ -0,0 +1,236 @@
+import csv
+import json
+from codecs import BOM_UTF8
+from tempfile import TemporaryFile
+
+from StringIO import StringIO
+
+
+class Participant(object):
+    """ One participant row from the import input. Values are always unicode,
+        missing columns are empty strings. row is the row number in the input,
+        if known. roles is the optional column with comma separated roles for
+        this participant, see split_roles.
+    """
+    fields = ('userid', 'password', 'email', 'first_name', 'last_name', 'roles')
+    __slots__ = fields + ('row', )
+
+    def __init__(self, userid, password = u"", email = u"", first_name = u"", last_name = u"", roles = u"", row = None):
+        self.userid = userid
+        self.password = password
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.roles = roles
+        self.row = row
+
+    @classmethod
+    def from_row(cls, values, row = None, columns = None):
+        """ Create from a row of unicode values. columns is the field name of each
+            column, or None for positional columns. An empty row results in an
+            empty userid.
+        """
+        if columns is not None:
+            data = dict((name, value) for (name, value) in zip(columns, values) if name)
+            values = [data.get(name, u"") for name in cls.fields]
+        values = list(values[:len(cls.fields)]) or [u""]
+        return cls(*values, row = row)
+
+    @classmethod
+    def from_dict(cls, data, row = None):
+        """ Create from a dict, like a decoded json object. Missing keys become
+            empty strings. Raises ValueError if data isn't a dict.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Row %s isn't an object" % row)
+        values = [data.get(name) or u"" for name in cls.fields]
+        if isinstance(values[-1], list):
+            values[-1] = u",".join(values[-1])
+        return cls(*[unicode(x) for x in values], row = row)
+
+    def as_dict(self):
+        output = dict(zip(self.fields, self.values()))
+        output['row'] = self.row
+        return output
+
+    def values(self):
+        """ The values of fields, as a tuple. """
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def get_roles(self, default = ()):
+        """ The roles of the roles column, or default if it's empty. """
+        return split_roles(self.roles) or tuple(default)
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.userid)
+
+
+def split_roles(value):
+    """ Return a tuple of role names from comma separated text. The role: prefix
+        may be left out, so "Voter, role:Discussion" gives ('role:Voter', 'role:Discussion').
+    """
+    roles = []
+    for name in value.split(u","):
+        name = name.strip()
+        if not name:
+            continue
+        if not name.startswith(u"role:"):
+            name = u"role:%s" % name
+        roles.append(name)
+    return tuple(roles)
+
+
+def _normalize_header(value):
+    return value.strip().lower().replace(u" ", u"").replace(u"_", u"").replace(u"-", u"")
+
+
+#: Header names, as compared by _normalize_header, and the field they map to
+HEADER_ALIASES = {u'userid': 'userid',
+                  u'username': 'userid',
+                  u'login': 'userid',
+                  u'password': 'password',
+                  u'email': 'email',
+                  u'mail': 'email',
+                  u'emailaddress': 'email',
+                  u'firstname': 'first_name',
+                  u'givenname': 'first_name',
+                  u'lastname': 'last_name',
+                  u'surname': 'last_name',
+                  u'familyname': 'last_name',
+                  u'roles': 'roles',
+                  u'role': 'roles'}
+
+SNIFF_SIZE = 16 * 1024
+DELIMITERS = ';,\t'
+
+
+def header_columns(values):
+    """ If values looks like a header row, return the field name for each column,
+        with None for columns that aren't recognized. Otherwise return None.
+        A header must name the userid column and at least one more field, name
+        each field at most once, and at least half of its cells must be recognized.
+        A row with an email address is always data, so a first row like
+        "login;;login@example.com" isn't mistaken for a header.
+    """
+    if [x for x in values if u"@" in x]:
+        return None
+    columns = [HEADER_ALIASES.get(_normalize_header(x)) for x in values]
+    if 'userid' not in columns:
+        return None
+    known = [x for x in columns if x]
+    if len(known) < 2 or len(set(known)) != len(known):
+        return None
+    cells = len([x for x in values if x.strip()])
+    if len(known) * 2 < cells:
+        return None
+    return columns
+
+
+def participants_from_rows(rows):
+    """ Yield Participant records from rows of unicode values, from any format.
+        If the first row is a header, columns are mapped by name, otherwise they're
+        positional in the order of Participant.fields. Row numbers include the header.
+    """
+    columns = None
+    for (i, values) in enumerate(rows):
+        if i == 0:
+            columns = header_columns(values)
+            if columns is not None:
+                continue
+        yield Participant.from_row(values, row = i + 1, columns = columns)
+
+
+def sniff_delimiter(sample, default = ';'):
+    """ Guess the delimiter of a csv sample, among DELIMITERS. default is picked if
+        it's used consistently, since the sniffer prefers ',' when both look
+        consistent, as with a roles column like "Voter,Discussion".
+    """
+    # only analyze complete lines
+    if len(sample) >= SNIFF_SIZE and "\n" in sample:
+        sample = sample[:sample.rindex("\n")]
+    sniffer = csv.Sniffer()
+    for delimiters in (default, DELIMITERS):
+        try:
+            return sniffer.sniff(sample, delimiters = delimiters).delimiter
+        except csv.Error:
+            pass
+    return default
+
+
+def iter_participants(fp, delimiter = None):
+    """ Yield Participant records from a seekable file-like object containing UTF-8
+        encoded csv. A byte order mark, which Excel writes first in "CSV UTF-8" files,
+        is skipped. Unless a delimiter is given, it's detected from the first
+        SNIFF_SIZE bytes.
+    """
+    start = fp.tell()
+    if fp.read(len(BOM_UTF8)) == BOM_UTF8:
+        start = fp.tell()
+    fp.seek(start)
+    if delimiter is None:
+        delimiter = sniff_delimiter(fp.read(SNIFF_SIZE))
+        fp.seek(start)
+    rows = csv.reader(fp, delimiter = delimiter, quotechar = '"')
+    return participants_from_rows([x.decode('UTF-8') for x in values] for values in rows)
+
+
+def iter_ndjson_participants(fp):
+    """ Yield Participant records from a file-like object with one json object per line.
+        Blank lines are ignored, but still counted as rows.
+    """
+    for (i, line) in enumerate(fp):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError, exc:
+            raise ValueError("Row %s: %s" % (i + 1, exc))
+        yield Participant.from_dict(data, row = i + 1)
+
+
+def parse_json_participants(items):
+    """ Return a list of Participant records from a decoded json list of objects. """
+    if not isinstance(items, list):
+        raise ValueError("participants must be a list")
+    return [Participant.from_dict(x, row = i + 1) for (i, x) in enumerate(items)]
+
+
+def parse_participants(value):
+    """ Parse unicode csv, separated by semicolons, into a list of Participant records. """
+    # csv wants ascii or utf-8
+    return list(iter_participants(StringIO(value.encode('UTF-8')), delimiter = ';'))
+
+
+def _encode(participant):
+    return [x.encode('UTF-8') for x in participant.values()]
+
+
+def iter_csv(participants):
+    """ Yield participants as lines of UTF-8 encoded csv, in the same format as
+        the import input.
+    """
+    buf = StringIO()
+    writer = csv.writer(buf, delimiter=';', quotechar='"')
+    for participant in participants:
+        writer.writerow(_encode(participant))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def write_csv(fp, participants):
+    """ Write participants to fp as UTF-8 encoded csv, in the same format as iter_csv. """
+    writer = csv.writer(fp, delimiter=';', quotechar='"')
+    for participant in participants:
+        writer.writerow(_encode(participant))
+
+
+def spool_participants(participants):
+    """ Write participants to a temporary file and return an iterator that reads
+        them back. Used to hand over rows from a stream that will be closed,
+        like an upload, without keeping them in memory.
+    """
+    fp = TemporaryFile()
+    write_csv(fp, participants)
+    fp.seek(0)
+    return iter_participants(fp, delimiter = ';')
@@ -0,0 +1,64 @@
+import csv
+
+from StringIO import StringIO
+
+
+MAX_ERRORS_SETTING = 'voteit.importparticipants.max_errors'
+REPORT_SESSION_KEY = 'voteit.importparticipants.validation_report'
+
+
+def get_max_errors(registry):
+    """ Validation of an import stops after this many errors, from the setting
+        voteit.importparticipants.max_errors.
+    """
+    settings = registry.settings or {}
+    return int(settings.get(MAX_ERRORS_SETTING, 100))
+
+
+class ReportFull(Exception):
+    """ Raised when a ValidationReport has reached its limit. """
+
+
+class ValidationReport(object):
+    """ Collects validation errors of an import as (row, column, code, value) entries.
+        When limit entries have been added, ReportFull is raised so the caller can
+        stop scanning.
+    """
+
+    def __init__(self, limit = 100):
+        self.limit = limit
+        self.entries = []
+        self.full = False
+
+    def add(self, row, column, code, value = u""):
+        self.entries.append((row, column, code, value))
+        if len(self.entries) >= self.limit:
+            self.full = True
+            raise ReportFull()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def values(self, code):
+        """ Unique values for code, in the order they were found. """
+        seen = set()
+        output = []
+        for (row, column, entry_code, value) in self.entries:
+            if entry_code == code and value not in seen:
+                seen.add(value)
+                output.append(value)
+        return output
+
+
+def iter_report_csv(entries):
+    """ Yield report entries as lines of UTF-8 encoded csv, with a header. """
+    buf = StringIO()
+    writer = csv.writer(buf, delimiter=';', quotechar='"')
+    writer.writerow(['row', 'column', 'code', 'value'])
+    for (row, column, code, value) in entries:
+        writer.writerow([str(row), column, code, value.encode('UTF-8')])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if not entries:
+        yield buf.getvalue()
@@ -1,21 +1,71 @@
 import colander
 import deform
+from pyramid.security import has_permission
+from pyramid.traversal import find_root
 from betahaus.pyracont.decorators import schema_factory
 
 from voteit.core import security
+from voteit.core.models.interfaces import IMeeting
 
-from voteit.importparticipants.validators import csv_participant_validator
 from voteit.importparticipants import VoteITImportParticipants as _
 
 
-@schema_factory('AddParticipantsSchema',
-                title = _(u"Add meeting participants"),
-                description = _(u"add_participants_schema_main_description",
-                                default = u"""Import participants from CSV. If different participants should 
-                                have different rights you should import one level of rights at a time. 
-                                Normally users have discuss, propose and vote."""))
-class AddParticipantsSchema(colander.Schema):
-    roles = colander.SchemaNode(
+class ParticipantsCSV(colander.String):
+    """ Deserializes pasted csv into a list of Participant records,
+        so validation and import work on the same parsed rows.
+    """
+
+    def deserialize(self, node, cstruct):
+        value = super(ParticipantsCSV, self).deserialize(node, cstruct)
+        if value is colander.null:
+            return value
+        from voteit.importparticipants.validators import parse_csv_participants
+        return parse_csv_participants(node, value)
+
+
+class MemoryTmpStore(dict):
+    """ Upload tmpstore for a single request. It only keeps a reference to
+        the uploaded file, so the file itself stays spooled on disk.
+    """
+
+    def preview_url(self, uid):
+        return None
+
+
+@colander.deferred
+def deferred_upload_widget(node, kw):
+    return deform.widget.FileUploadWidget(MemoryTmpStore())
+
+
+# The validators module is imported when a schema is bound, not when this module
+# is scanned at startup.
+
+@colander.deferred
+def csv_participant_validator(node, kw):
+    from voteit.importparticipants.validators import CSVParticipantValidator
+    return CSVParticipantValidator(kw['context'], kw['api'])
+
+
+@colander.deferred
+def csv_resume_participant_validator(node, kw):
+    from voteit.importparticipants.validators import CSVParticipantValidator
+    return CSVParticipantValidator(kw['context'], kw['api'], resume = True)
+
+
+@colander.deferred
+def csv_file_participant_validator(node, kw):
+    from voteit.importparticipants.validators import CSVFileParticipantValidator
+    return CSVFileParticipantValidator(kw['context'], kw['api'], resume = True)
+
+
+@colander.deferred
+def csv_file_sync_validator(node, kw):
+    from voteit.importparticipants.validators import CSVFileParticipantValidator
+    return CSVFileParticipantValidator(kw['context'], kw['api'], sync = True)
+
+
+def roles_node():
+    return colander.SchemaNode(
         deform.Set(),
         title = _(u"Roles"),
         default = (security.ROLE_DISCUSS, security.ROLE_PROPOSE, security.ROLE_VOTER),
@@ -25,14 +75,131 @@ class AddParticipantsSchema(colander.Schema):
                         to add a user that can only view, select View and uncheck everything else."""),
         widget = deform.widget.CheckboxChoiceWidget(values=security.MEETING_ROLES,),
     )
-    csv = colander.SchemaNode(colander.String(),
+
+
+def send_credentials_node():
+    return colander.SchemaNode(
+        colander.Boolean(),
+        title = _(u"Email credentials"),
+        description = _(u"send_credentials_description",
+                        default = u"Send each new participant with an email address their userid and password."),
+        default = False,
+        missing = False,
+    )
+
+
+def csv_node(validator = csv_participant_validator):
+    return colander.SchemaNode(ParticipantsCSV(),
                                  title = _(u"add_participants_csv_title",
                                            default=u"CSV list of participants"),
                                  description = _(u"add_participants_csv_description",
                                                  default=u"""A semicolon separated csv, with the following columns 
                                                  prefered userid (mandatory); password (if left empty a random 
                                                  password will be generated); email (not mandatory, but recommended); 
-                                                 firstname; lastname"""),
+                                                 firstname; lastname; roles (not mandatory, comma separated like 
+                                                 "Viewer, Voter")"""),
                                  widget = deform.widget.TextAreaWidget(rows=25, cols=75),
-                                 validator = csv_participant_validator,
-    )
\ No newline at end of file
+                                 validator = validator,
+    )
+
+
+def managed_meetings(context, request):
+    """ Return (name, meeting) for the other meetings in the site where the
+        current user may manage participants.
+    """
+    root = find_root(context)
+    return [(name, obj) for (name, obj) in root.items()
+            if IMeeting.providedBy(obj) and obj is not context and
+            has_permission(security.MANAGE_GROUPS, obj, request)]
+
+
+@colander.deferred
+def deferred_meetings_widget(node, kw):
+    values = [(name, obj.title) for (name, obj) in managed_meetings(kw['context'], kw['request'])]
+    return deform.widget.SelectWidget(values = values)
+
+
+@colander.deferred
+def deferred_meetings_validator(node, kw):
+    names = [name for (name, obj) in managed_meetings(kw['context'], kw['request'])]
+    return colander.OneOf(names)
+
+
+class MeetingRolesSchema(colander.Schema):
+    meeting = colander.SchemaNode(colander.String(),
+                                  title = _(u"Meeting"),
+                                  widget = deferred_meetings_widget,
+                                  validator = deferred_meetings_validator)
+    roles = roles_node()
+
+
+class MeetingRolesSequence(colander.SequenceSchema):
+    target = MeetingRolesSchema(title = _(u"Meeting"))
+
+
+@schema_factory('AddParticipantsSchema',
+                title = _(u"Add meeting participants"),
+                description = _(u"add_participants_schema_main_description",
+                                default = u"""Import participants from CSV. The selected roles are given to
+                                every participant without roles of their own in the roles column.
+                                Normally users have discuss, propose and vote."""))
+class AddParticipantsSchema(colander.Schema):
+    roles = roles_node()
+    csv = csv_node(validator = csv_resume_participant_validator)
+    send_credentials = send_credentials_node()
+
+
+@schema_factory('AddParticipantsMultipleSchema',
+                title = _(u"Add participants to several meetings"),
+                description = _(u"add_participants_multiple_schema_main_description",
+                                default = u"""Import participants from CSV into this meeting and the other
+                                meetings added below. Each user is only created once. The roles column of
+                                the csv overrides the selected roles in every meeting."""))
+class AddParticipantsMultipleSchema(colander.Schema):
+    roles = roles_node()
+    csv = csv_node()
+    send_credentials = send_credentials_node()
+    meetings = MeetingRolesSequence(title = _(u"Other meetings"))
+
+
+@schema_factory('AddParticipantsFileSchema',
+                title = _(u"Add meeting participants from file"),
+                description = _(u"add_participants_file_schema_main_description",
+                                default = u"""Import participants from an uploaded CSV file. The file is read
+                                row by row, so use this for large lists of participants."""))
+class AddParticipantsFileSchema(colander.Schema):
+    roles = roles_node()
+    upload = colander.SchemaNode(deform.FileData(),
+                                 title = _(u"add_participants_upload_title",
+                                           default=u"CSV file with participants"),
+                                 description = _(u"add_participants_upload_description",
+                                                 default=u"""A UTF-8 encoded csv file separated by semicolons, commas or 
+                                                 tabs, or an Excel .xlsx file. Columns are either in the same order as 
+                                                 when pasting participants: userid; password; email; firstname; 
+                                                 lastname; roles, or named in a header row."""),
+                                 widget = deferred_upload_widget,
+                                 validator = csv_file_participant_validator,
+    )
+    send_credentials = send_credentials_node()
+
+
+@schema_factory('SyncParticipantsSchema',
+                title = _(u"Sync meeting participants"),
+                description = _(u"sync_participants_schema_main_description",
+                                default = u"""Update the meeting from a complete roster. Users that don't exist
+                                are created, existing users get the selected roles if they're missing them, and
+                                participants that aren't in the roster lose the selected roles."""))
+class SyncParticipantsSchema(colander.Schema):
+    roles = roles_node()
+    upload = colander.SchemaNode(deform.FileData(),
+                                 title = _(u"sync_participants_upload_title",
+                                           default=u"CSV file with the roster"),
+                                 description = _(u"add_participants_upload_description",
+                                                 default=u"""A UTF-8 encoded csv file separated by semicolons, commas or 
+                                                 tabs, or an Excel .xlsx file. Columns are either in the same order as 
+                                                 when pasting participants: userid; password; email; firstname; 
+                                                 lastname; roles, or named in a header row."""),
+                                 widget = deferred_upload_widget,
+                                 validator = csv_file_sync_validator,
+    )
+    send_credentials = send_credentials_node()
@@ -0,0 +1,213 @@
+""" Console script to import participants outside of the web server.
+
+    voteit_import_participants production.ini /meeting-name roster.xlsx --output credentials.csv
+
+    The site's database is opened from the ini file, so the server should be stopped,
+    or the database served by ZEO.
+"""
+import argparse
+import sys
+from datetime import datetime
+from time import time
+
+import transaction
+from pyramid.paster import bootstrap
+from pyramid.paster import setup_logging
+from pyramid.request import Request
+from pyramid.traversal import find_resource
+from voteit.core import security
+from voteit.core.models.interfaces import IMeeting
+from voteit.core.views.api import APIView
+
+from voteit.importparticipants.credentials import get_credential_generator
+from voteit.importparticipants.formats import get_participant_format
+from voteit.importparticipants.hashing import get_password_hasher
+from voteit.importparticipants.importer import ParticipantImporter
+from voteit.importparticipants.importer import get_defer_indexing
+from voteit.importparticipants.importer import import_key
+from voteit.importparticipants.importer import participants_digest
+from voteit.importparticipants.mailing import credential_mail
+from voteit.importparticipants.mailing import get_credential_mailer
+from voteit.importparticipants.models import find_import_progress
+from voteit.importparticipants.models import get_import_progress
+from voteit.importparticipants.models import get_result_dir
+from voteit.importparticipants.parsing import iter_csv
+from voteit.importparticipants.report import iter_report_csv
+from voteit.importparticipants.validators import CSVParticipantValidator
+
+
+DEFAULT_ROLES = (security.ROLE_DISCUSS, security.ROLE_PROPOSE, security.ROLE_VOTER)
+
+
+class BulkImport(object):
+    """ Validates and imports a roster file into meeting, with a commit every
+        chunk_size rows. Progress and throughput are written to log after every commit.
+        An interrupted import can be run again with the same file and roles, and
+        will continue after the last commit.
+    """
+
+    def __init__(self, meeting, request, roles = DEFAULT_ROLES, chunk_size = 1000,
+                 commit = transaction.commit, log = sys.stderr):
+        self.meeting = meeting
+        self.request = request
+        self.roles = tuple(roles)
+        self.chunk_size = chunk_size
+        self.commit = commit
+        self.log = log
+        self.total = 0
+
+    def validate(self, get_participants):
+        """ Return a ValidationReport with the errors of the roster. Rows committed by
+            an earlier run with the same roles aren't checked again.
+        """
+        progress = self._progress(participants_digest(get_participants()))
+        skip = progress and progress.cursor or 0
+        validator = CSVParticipantValidator(self.meeting, APIView(self.meeting, self.request))
+        self.total = 0
+        return validator.check(self._count(get_participants()), skip = skip, check_html = True)
+
+    def check_previous(self, get_participants):
+        """ Raises ValueError if the roster has already been imported into the meeting,
+            with these or other roles.
+        """
+        self._check_previous(participants_digest(get_participants()))
+
+    def _check_previous(self, digest):
+        progress = self._progress(digest)
+        if progress is None and find_import_progress(self.meeting, digest) is not None:
+            raise ValueError("This roster has already been imported into the meeting with other roles, "
+                             "use the sync form to change their roles")
+        if progress is not None and progress.finished:
+            raise ValueError("This roster has already been imported into the meeting")
+
+    def _progress(self, digest):
+        """ The ImportProgress of this roster and roles, or None. """
+        return get_import_progress(self.meeting, import_key(self.meeting, self.roles, digest))
+
+    def _count(self, participants):
+        for participant in participants:
+            self.total += 1
+            yield participant
+
+    def __call__(self, get_participants):
+        """ Import the roster and return the ImportProgress with the result.
+            Raises ValueError if it has already been imported, see check_previous.
+        """
+        registry = self.request.registry
+        digest = participants_digest(get_participants())
+        self._check_previous(digest)
+        key = import_key(self.meeting, self.roles, digest)
+        progress = get_import_progress(self.meeting, key, create = True, digest = digest)
+        progress.spool_results(get_result_dir(registry))
+        progress.total = self.total or None
+        if progress.cursor:
+            self.log.write("Resuming after row %s\n" % progress.cursor)
+        importer = ParticipantImporter(self.meeting, self.roles,
+                                       generate_passwords = get_credential_generator(registry).generate,
+                                       defer_indexing = get_defer_indexing(registry),
+                                       hasher = get_password_hasher(registry))
+        start = time()
+        resumed = progress.cursor
+
+        def _commit():
+            self.commit()
+            elapsed = time() - start
+            rows = progress.cursor - resumed
+            self.log.write("Imported %s/%s rows, %.1f rows/s\n" %
+                           (progress.cursor, progress.total or '?', elapsed and rows / elapsed or 0))
+
+        importer.import_chunked(get_participants(), progress, self.chunk_size, commit = _commit)
+        progress.finished = datetime.utcnow()
+        _commit()
+        return progress
+
+
+def import_participants(argv = sys.argv):
+    """ Entry point of the voteit_import_participants console script. """
+    parser = argparse.ArgumentParser(description = "Import participants into a VoteIT meeting.")
+    parser.add_argument('config_uri', help = "Pyramid ini file of the site.")
+    parser.add_argument('meeting', help = "Path of the meeting, like /my-meeting")
+    parser.add_argument('roster', help = "Csv or xlsx file with participants, in the same format as for the upload form.")
+    parser.add_argument('--role', dest = 'roles', action = 'append', default = None,
+                        help = "Role for participants without a roles column. May be repeated. "
+                               "Default: %s" % ", ".join(DEFAULT_ROLES))
+    parser.add_argument('--chunk-size', type = int, default = 1000,
+                        help = "Rows per commit.")
+    parser.add_argument('--output', default = None,
+                        help = "Write userids and passwords as csv to this file instead of stdout.")
+    parser.add_argument('--validate-only', action = 'store_true',
+                        help = "Only check the roster, don't import anything.")
+    parser.add_argument('--send-credentials', action = 'store_true',
+                        help = "Email participants their userid and password, with the mail settings of the site.")
+    parser.add_argument('--base-url', default = None,
+                        help = "Public url of the site, used for links in emails.")
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    request = None
+    if args.base_url:
+        request = Request.blank('/', base_url = args.base_url)
+    env = bootstrap(args.config_uri, request = request)
+    try:
+        meeting = find_resource(env['root'], args.meeting)
+        if not IMeeting.providedBy(meeting):
+            parser.error("%s isn't a meeting" % args.meeting)
+        roles = args.roles or DEFAULT_ROLES
+        valid_roles = set(name for (name, title) in security.MEETING_ROLES)
+        if set(roles) - valid_roles:
+            parser.error("Invalid roles: %s" % ", ".join(set(roles) - valid_roles))
+        # sent right away by this script, so the mail queue isn't needed
+        mailer = get_credential_mailer(env['registry'], queued = False)
+        if args.send_credentials and mailer is None:
+            sys.stderr.write("Email isn't configured for the site, include pyramid_mailer "
+                             "and its mail settings in %s\n" % args.config_uri)
+            return 2
+        read = get_participant_format(env['registry'], args.roster)
+        with open(args.roster, 'rb') as fp:
+            def get_participants():
+                fp.seek(0)
+                return read(fp)
+            bulk = BulkImport(meeting, env['request'], roles = roles, chunk_size = args.chunk_size)
+            start = time()
+            try:
+                report = bulk.validate(get_participants)
+            except ValueError, exc:
+                sys.stderr.write("Can't read %s: %s\n" % (args.roster, exc))
+                return 2
+            sys.stderr.write("Validated %s rows in %.1fs\n" % (bulk.total, time() - start))
+            try:
+                bulk.check_previous(get_participants)
+            except ValueError, exc:
+                sys.stderr.write("%s\n" % exc)
+                return 1
+            if report:
+                sys.stderr.write("The roster has errors:\n")
+                for line in iter_report_csv(report.entries):
+                    sys.stderr.write(line)
+                return 1
+            if args.validate_only:
+                return 0
+            try:
+                progress = bulk(get_participants)
+            except ValueError, exc:
+                sys.stderr.write("%s\n" % exc)
+                return 1
+        out = args.output and open(args.output, 'wb') or sys.stdout
+        try:
+            for line in iter_csv(progress.iter_participants()):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if args.send_credentials:
+            mail = credential_mail(env['request'], meeting, progress.iter_participants())
+            sys.stderr.write("Sending %s credential emails\n" % len(mail.recipients))
+            failed = mailer.deliver(mail)
+            if failed:
+                sys.stderr.write("%s emails couldn't be sent, see the log\n" % failed)
+        # the passwords have been written, don't keep them in the database
+        progress.clear_results()
+        transaction.commit()
+        return 0
+    finally:
+        env['closer']()
@@ -0,0 +1,80 @@
+from pyramid.traversal import find_root
+from zope.component.event import objectEventNotify
+from betahaus.pyracont.events import ObjectUpdatedEvent
+
+from voteit.importparticipants.userids import userid_slug
+
+
+class RosterSync(object):
+    """ Applies a roster to a meeting as a set of changes instead of a full import.
+        roles are the roles the roster manages, and the default for rows with an
+        empty roles column:
+
+        - Rows are matched with users by the userid a new user would get, see
+          userids.userid_slug, so "anna_b" is the user anna-b.
+        - Rows with a userid that doesn't exist are created by importer.
+        - Existing users get the roles of their row that they're missing, and lose
+          managed roles that their row doesn't have. Their user objects aren't touched.
+        - Members of the meeting that aren't in the roster lose the managed roles,
+          other roles are kept. Userids in keep are never changed.
+
+        Existing users are compared with set lookups, so the work that writes to the
+        database is proportional to the changes. The meeting gets one object updated
+        event if any roles were changed.
+    """
+
+    def __init__(self, meeting, roles, importer, keep = ()):
+        self.meeting = meeting
+        self.roles = frozenset(roles)
+        self.importer = importer
+        self.users = find_root(meeting).users
+        self.keep = set(keep)
+        self.seen = set()
+        self.created = []
+        self.added = {}
+        self.removed = {}
+        self.unchanged = 0
+
+    def __call__(self, participants):
+        self.created = self.importer(self._existing_filter(participants))
+        self.seen.update(x.userid for x in self.created)
+        self.remove_missing()
+        if self.added or self.removed:
+            objectEventNotify(ObjectUpdatedEvent(self.meeting))
+        return self
+
+    def _existing_filter(self, participants):
+        """ Sync the users that exist, and yield the ones that should be created. """
+        for participant in participants:
+            userid = userid_slug(participant.userid)
+            if userid in self.users:
+                self.seen.add(userid)
+                self.sync_user(userid, participant.get_roles(self.roles))
+            else:
+                yield participant
+
+    def sync_user(self, userid, roles):
+        roles = frozenset(roles)
+        current = set(self.meeting.get_groups(userid))
+        missing = roles - current
+        removed = (current & (self.roles | roles)) - roles
+        if not missing and not removed:
+            self.unchanged += 1
+            return
+        if missing:
+            self.added[userid] = missing
+        if removed:
+            self.removed[userid] = removed
+        self.meeting.set_groups(userid, (current | missing) - removed, event = False)
+
+    def remove_missing(self):
+        """ Remove the managed roles from members that weren't in the roster. """
+        for entry in self.meeting.get_security():
+            userid = entry['userid']
+            if userid in self.seen or userid in self.keep:
+                continue
+            groups = set(entry['groups'])
+            removed = groups & self.roles
+            if removed:
+                self.meeting.set_groups(userid, groups - removed, event = False)
+                self.removed[userid] = removed
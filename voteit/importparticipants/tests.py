@@ -16,11 +16,17 @@ from voteit.core.models.meeting import Meeting
 class AddParticipantsViewTests(unittest.TestCase):
     
     def setUp(self):
+        from tempfile import mkdtemp
+        from voteit.importparticipants.models import RESULT_DIR_SETTING
         self.request = testing.DummyRequest()
         self.config = testing.setUp(request = self.request)
+        self.result_dir = mkdtemp()
+        self.config.registry.settings[RESULT_DIR_SETTING] = self.result_dir
 
     def tearDown(self):
+        from shutil import rmtree
         testing.tearDown()
+        rmtree(self.result_dir)
     
     @property
     def _cut(self):
@@ -51,30 +57,28 @@ class AddParticipantsViewTests(unittest.TestCase):
         obj = self._cut(context, self.request)
         output = obj._import_participants(u"user1;password1;user1@test.com;Dummy;User\n", ("role:Admin", ))
         self.assertEqual(len(output), 1)
-        self.assertEqual(len(output[0]), 5)
-        self.assertEqual(output[0]['password'], u'password1')
-        self.assertEqual(output[0]['email'], u'user1@test.com')
-        self.assertEqual(output[0]['first_name'], u'Dummy')
-        self.assertEqual(output[0]['last_name'], u'User')
+        self.assertEqual(output[0].userid, u'user1')
+        self.assertEqual(output[0].password, u'password1')
+        self.assertEqual(output[0].email, u'user1@test.com')
+        self.assertEqual(output[0].first_name, u'Dummy')
+        self.assertEqual(output[0].last_name, u'User')
         
     def test__import_participants_empty_password(self):
         context = self._meeting_fixture()
         obj = self._cut(context, self.request)
         output = obj._import_participants(u"user1;;user1@test.com;Dummy;User\n", ("role:Admin", ))
         self.assertEqual(len(output), 1)
-        self.assertEqual(len(output[0]), 5)
-        self.assertNotEqual(output[0]['password'], u'')
+        self.assertNotEqual(output[0].password, u'')
         
     def test__import_participants_short(self):
         context = self._meeting_fixture()
         obj = self._cut(context, self.request)
         output = obj._import_participants(u"user1\n", ("role:Admin", ))
         self.assertEqual(len(output), 1)
-        self.assertEqual(len(output[0]), 5)
-        self.assertNotEqual(output[0]['password'], u"")
-        self.assertEqual(output[0]['email'], u"")
-        self.assertEqual(output[0]['first_name'], u"")
-        self.assertEqual(output[0]['last_name'], u"")
+        self.assertNotEqual(output[0].password, u"")
+        self.assertEqual(output[0].email, u"")
+        self.assertEqual(output[0].first_name, u"")
+        self.assertEqual(output[0].last_name, u"")
         
     def test__import_participants_no_userid(self):
         context = self._meeting_fixture()
@@ -85,8 +89,8 @@ class AddParticipantsViewTests(unittest.TestCase):
         context = self._meeting_fixture()
         obj = self._cut(context, self.request)
         output = obj._import_participants(u"user1;password1;user1@test.com;Dömmy;用户\n", ("role:Admin", ))
-        self.assertEqual(output[0]['first_name'], u"Dömmy")
-        self.assertEqual(output[0]['last_name'], u"用户")
+        self.assertEqual(output[0].first_name, u"Dömmy")
+        self.assertEqual(output[0].last_name, u"用户")
         
     def test__import_participants_multiple(self):
         context = self._meeting_fixture()
@@ -94,11 +98,10 @@ class AddParticipantsViewTests(unittest.TestCase):
         output = obj._import_participants(u"user1;password1;user1@test.com;Dummy;User\nuser2;password2;user2@test.com;Dummy;User", 
                                           ("role:Admin", ))
         self.assertEqual(len(output), 2)
-        self.assertEqual(len(output[0]), 5)
-        self.assertEqual(output[0]['password'], u'password1')
-        self.assertEqual(output[0]['email'], u'user1@test.com')
-        self.assertEqual(output[0]['first_name'], u'Dummy')
-        self.assertEqual(output[0]['last_name'], u'User')
+        self.assertEqual(output[0].password, u'password1')
+        self.assertEqual(output[0].email, u'user1@test.com')
+        self.assertEqual(output[0].first_name, u'Dummy')
+        self.assertEqual(output[0].last_name, u'User')
         
     def test__import_participants_multiple_duplicate_userid(self):
         context = self._meeting_fixture()
@@ -106,7 +109,7 @@ class AddParticipantsViewTests(unittest.TestCase):
         output = obj._import_participants(u"user1;password1;user1@test.com;Dummy;User\nuser1;password2;user2@test.com;Dummy;User", 
                                           ("role:Admin", ))
         self.assertEqual(len(output), 2)
-        self.assertEqual(output[1]['userid'], u'user1-1')
+        self.assertEqual(output[1].userid, u'user1-1')
         
     def test__import_participants_check_password(self):
         context = self._meeting_fixture()
@@ -117,8 +120,8 @@ class AddParticipantsViewTests(unittest.TestCase):
         output = obj._import_participants(u"\n".join(participants), ("role:Admin", ))
         users = context.__parent__.users
         for n in range(0, len(output)):
-            username = output[n]['userid']
-            password = output[n]['password']
+            username = output[n].userid
+            password = output[n].password
             pw_field = users[username].get_custom_field('password')
             self.assertTrue(pw_field.check_input(password))
         
@@ -159,6 +162,172 @@ class AddParticipantsViewTests(unittest.TestCase):
         response = obj.add_participants()
         self.assertIn('1 participant added', response.body)
         
+    def _add_request(self, context, csv, role = 'role:Admin'):
+        return testing.DummyRequest(context = context,
+                                    post = MultiDict([('csv', csv),
+                                                      ('__start__', 'roles:sequence'),
+                                                      ('checkbox', role),
+                                                      ('__end__', 'roles:sequence'),
+                                                      ('csrf_token', '0123456789012345678901234567890123456789'),
+                                                      ('add', 'add')]))
+
+    def test_add_participants_retry(self):
+        from pyramid.httpexceptions import HTTPFound
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        self._cut(context, self._add_request(context, 'user1;;user1@test.com\n')).add_participants()
+        # whitespace and case of emails don't matter
+        response = self._cut(context, self._add_request(context, 'user1; ;USER1@test.com\n')).add_participants()
+        self.assertIsInstance(response, HTTPFound)
+        self.assertNotIn('user1-1', context.__parent__.users)
+
+    def test_add_participants_retry_large(self):
+        from voteit.importparticipants.views import RESULT_PREVIEW_ROWS
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        csv = u"\n".join([u"user%s" % n for n in range(RESULT_PREVIEW_ROWS + 1)])
+        first = self._cut(context, self._add_request(context, csv))
+        first.add_participants()
+        retry = self._cut(context, self._add_request(context, csv))
+        response = retry.add_participants()
+        self.assertIn('%s participants added' % (RESULT_PREVIEW_ROWS + 1), response.body)
+        self.assertEqual(retry.response['download_url'], first.response['download_url'])
+        self.assertNotIn('user0-1', context.__parent__.users)
+
+    def test_add_participants_queued(self):
+        from datetime import datetime
+        from pyramid.httpexceptions import HTTPFound
+        from voteit.importparticipants.importer import import_key
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import parse_participants
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        digest = participants_digest(parse_participants(u"user1\n"))
+        progress = get_import_progress(context, import_key(context, ('role:Admin', ), digest),
+                                       create = True, digest = digest)
+        progress.queued = datetime.utcnow()
+        response = self._cut(context, self._add_request(context, 'user1\n')).add_participants()
+        self.assertIsInstance(response, HTTPFound)
+        self.assertIn('import_status', response.location)
+        self.assertNotIn('user1', context.__parent__.users)
+
+    def test_add_participants_queued_job_lost(self):
+        from datetime import datetime
+        from datetime import timedelta
+        from voteit.importparticipants.importer import import_key
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import parse_participants
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        digest = participants_digest(parse_participants(u"user1\n"))
+        progress = get_import_progress(context, import_key(context, ('role:Admin', ), digest),
+                                       create = True, digest = digest)
+        # queued by a process that has been restarted since
+        progress.queued = datetime.utcnow() - timedelta(hours = 1)
+        response = self._cut(context, self._add_request(context, 'user1\n')).add_participants()
+        self.assertIn('1 participant added', response.body)
+        self.assertIn('user1', context.__parent__.users)
+
+    def test_add_participants_running(self):
+        from datetime import datetime
+        from pyramid.httpexceptions import HTTPFound
+        from voteit.importparticipants.importer import import_key
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import parse_participants
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        digest = participants_digest(parse_participants(u"user1\n"))
+        progress = get_import_progress(context, import_key(context, ('role:Admin', ), digest),
+                                       create = True, digest = digest)
+        # started by a request that hasn't finished yet
+        progress.started = datetime.utcnow()
+        response = self._cut(context, self._add_request(context, 'user1\n')).add_participants()
+        self.assertIsInstance(response, HTTPFound)
+        self.assertIn('import_status', response.location)
+        self.assertNotIn('user1', context.__parent__.users)
+
+    def test_add_participants_failed_is_resumed(self):
+        from datetime import datetime
+        from voteit.importparticipants.importer import import_key
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import parse_participants
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        digest = participants_digest(parse_participants(u"user1\n"))
+        progress = get_import_progress(context, import_key(context, ('role:Admin', ), digest),
+                                       create = True, digest = digest)
+        progress.started = datetime.utcnow()
+        progress.add_error(u"Interrupted")
+        response = self._cut(context, self._add_request(context, 'user1\n')).add_participants()
+        self.assertIn('1 participant added', response.body)
+        self.assertEqual(progress.errors, ())
+
+    def test_add_participants_other_roles(self):
+        from pyramid.httpexceptions import HTTPFound
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        self._cut(context, self._add_request(context, 'user1\n')).add_participants()
+        request = self._add_request(context, 'user1\n', role = security.ROLE_VOTER)
+        response = self._cut(context, request).add_participants()
+        self.assertIsInstance(response, HTTPFound)
+        self.assertNotIn(security.ROLE_VOTER, context.get_groups('user1'))
+
+    def test_add_participants_multiple_after_import(self):
+        from voteit.importparticipants.report import REPORT_SESSION_KEY
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        self._cut(context, self._add_request(context, 'user1\n')).add_participants()
+        request = self._add_request(context, 'user1\n')
+        request.POST.extend([('__start__', 'meetings:sequence'), ('__end__', 'meetings:sequence')])
+        response = self._cut(context, request).add_participants_multiple()
+        # validated again, so the registered userid is an error
+        self.assertIn('form', response)
+        self.assertIn('user1', request.session[REPORT_SESSION_KEY][0])
+        self.assertNotIn('user1-1', context.__parent__.users)
+
+    def test_add_participants_save_instrumentation(self):
+        from voteit.importparticipants.interfaces import IImportInstrumentation
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.include('voteit.importparticipants.instrumentation')
+        self.config.testing_securitypolicy(userid='admin',
+                                           permissive=True)
+        self._tz_vc_fixture()
+        records = []
+        self.config.registry.getUtility(IImportInstrumentation).subscribe(records.append)
+        context = self._meeting_fixture()
+        request = testing.DummyRequest(context = context,
+                                       post = MultiDict([('csv', 'user1;;user1@test.com;Dummy;User\n'),
+                                                         ('__start__', 'roles:sequence'),
+                                                         ('checkbox', 'role:Admin'),
+                                                         ('__end__', 'roles:sequence'),
+                                                         ('csrf_token', '0123456789012345678901234567890123456789'),
+                                                         ('add', 'add')]))
+        obj = self._cut(context, request)
+        obj.add_participants()
+        phases = [x['phase'] for x in records]
+        for phase in ('form_validation', 'html_validation', 'parse', 'email_index', 'row_checks', 'create', 'render'):
+            self.assertIn(phase, phases)
+
     def test_add_participants_validation_error(self):
         self.config.scan('voteit.importparticipants.schemas')
         self.config.testing_securitypolicy(userid='dummy',
@@ -172,6 +341,391 @@ class AddParticipantsViewTests(unittest.TestCase):
         obj = self._cut(context, request)
         response = obj.add_participants()
         self.assertIn('form', response)
+
+
+    def test_add_participants_file_save(self):
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin',
+                                           permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        upload = _DummyUpload(u"user1;;user1@test.com;Dömmy;User\nuser2\n")
+        request = testing.DummyRequest(context = context,
+                                       post = MultiDict([('__start__', 'upload:mapping'),
+                                                         ('upload', upload),
+                                                         ('__end__', 'upload:mapping'),
+                                                         ('__start__', 'roles:sequence'),
+                                                         ('checkbox', 'role:Admin'),
+                                                         ('__end__', 'roles:sequence'),
+                                                         ('csrf_token', '0123456789012345678901234567890123456789'),
+                                                         ('add', 'add')]))
+        obj = self._cut(context, request)
+        response = obj.add_participants_file()
+        self.assertIn('2 participants added', response.body)
+        self.assertIn('user2', context.__parent__.users)
+
+    def test_add_participants_file_imports_in_chunks(self):
+        import transaction
+        from voteit.importparticipants.models import find_import_progress
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.parsing import parse_participants
+        self.config.scan('voteit.importparticipants.schemas')
+        self.config.testing_securitypolicy(userid='admin',
+                                           permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        roster = u"\n".join(u"user%s;;user%s@test.com" % (n, n) for n in range(150))
+        request = testing.DummyRequest(context = context,
+                                       post = MultiDict([('__start__', 'upload:mapping'),
+                                                         ('upload', _DummyUpload(roster)),
+                                                         ('__end__', 'upload:mapping'),
+                                                         ('__start__', 'roles:sequence'),
+                                                         ('checkbox', 'role:Voter'),
+                                                         ('__end__', 'roles:sequence'),
+                                                         ('csrf_token', '0123456789012345678901234567890123456789'),
+                                                         ('add', 'add')]))
+        commits = []
+        transaction.get().addBeforeCommitHook(lambda: commits.append(1))
+        obj = self._cut(context, request)
+        response = obj.add_participants_file()
+        self.assertIn('150 participants added', response.body)
+        # the start of the import was committed before any rows
+        self.assertEqual(commits, [1])
+        progress = find_import_progress(context, participants_digest(parse_participants(roster)))
+        self.assertEqual(progress.cursor, 150)
+        self.assertEqual(len(progress.get_participants()), 150)
+
+
+    def test_send_credentials(self):
+        from pyramid_mailer.interfaces import IMailer
+        from pyramid_mailer.mailer import DummyMailer
+        from voteit.importparticipants.parsing import Participant
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        self.config.include('voteit.importparticipants.mailing')
+        mailer = DummyMailer()
+        self.config.registry.registerUtility(mailer, IMailer)
+        context = self._meeting_fixture()
+        obj = self._cut(context, self.request)
+        obj._send_credentials([Participant(u'user1', u'secret', u'user1@test.com'), Participant(u'user2', u'secret')])
+        self.assertEqual([x.recipients for x in mailer.queue], [[u'user1@test.com']])
+        self.assertEqual(mailer.outbox, [])
+
+    def test_import_status_json(self):
+        from voteit.importparticipants.models import get_import_progress
+        self.config.testing_securitypolicy(userid='admin',
+                                           permissive=True)
+        context = self._meeting_fixture()
+        progress = get_import_progress(context, 'abc', create = True, total = 10)
+        progress.cursor = 4
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        obj = self._cut(context, request)
+        response = obj.import_status_json()
+        self.assertEqual(response['processed'], 4)
+        self.assertEqual(response['total'], 10)
+        self.assertEqual(response['finished'], False)
+        self.assertNotIn('result_url', response)
+
+    def test_lazy_view(self):
+        from voteit.importparticipants import lazy_view
+        from voteit.importparticipants.models import get_import_progress
+        self.config.testing_securitypolicy(userid='admin',
+                                           permissive=True)
+        context = self._meeting_fixture()
+        get_import_progress(context, 'abc', create = True, total = 10)
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        view = lazy_view('import_status_json')
+        self.assertEqual(view.__name__, 'import_status_json')
+        self.assertEqual(view(context, request)['total'], 10)
+
+    def test_import_status_json_not_found(self):
+        from pyramid.httpexceptions import HTTPNotFound
+        context = self._meeting_fixture()
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        obj = self._cut(context, request)
+        self.assertRaises(HTTPNotFound, obj.import_status_json)
+
+    def test_import_result(self):
+        from datetime import datetime
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import Participant
+        self.config.testing_securitypolicy(userid='admin',
+                                           permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        progress = get_import_progress(context, 'abc', create = True, total = 1)
+        progress.add(Participant(u'user1', u'secret'))
+        progress.finished = datetime.utcnow()
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        obj = self._cut(context, request)
+        response = obj.import_result()
+        self.assertIn('1 participant added', response.body)
+        self.assertIn('secret', response.body)
+        # kept until it expires
+        self.assertEqual(progress.result_count, 1)
+
+    def test_import_result_not_finished(self):
+        from voteit.importparticipants.models import get_import_progress
+        context = self._meeting_fixture()
+        get_import_progress(context, 'abc', create = True, total = 1)
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        obj = self._cut(context, request)
+        response = obj.import_result()
+        self.assertEqual(response.location, 'http://example.com/m/import_status?key=abc')
+
+
+    def test_render_result_large(self):
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import Participant
+        from voteit.importparticipants.views import RESULT_PREVIEW_ROWS
+        self.config.testing_securitypolicy(userid='admin',
+                                           permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        obj = self._cut(context, self.request)
+        output = [Participant(u'user%s' % n, u'secret%s' % n) for n in range(RESULT_PREVIEW_ROWS + 5)]
+        response = obj._render_result(output)
+        self.assertIn('import_credentials.csv', response.body)
+        self.assertNotIn('secret%s' % (RESULT_PREVIEW_ROWS + 1), response.body)
+        self.assertEqual(len(obj.response['participants']), RESULT_PREVIEW_ROWS)
+        key = obj.response['download_url'].split('key=')[1]
+        progress = get_import_progress(context, key)
+        self.assertEqual(progress.result_count, RESULT_PREVIEW_ROWS + 5)
+        # written to a file instead of the database
+        self.assertTrue(progress.result_path.startswith(self.result_dir))
+        self.assertEqual(len(progress.results), 0)
+        self.assertEqual(len(progress.get_participants()), RESULT_PREVIEW_ROWS + 5)
+
+    def test_import_credentials_csv(self):
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.models import store_import_result
+        from voteit.importparticipants.parsing import Participant
+        context = self._meeting_fixture()
+        store_import_result(context, 'abc', [Participant(u'user1', u'secret', u'user1@test.com', u'Dömmy'),
+                                             Participant(u'user2', u'secret2')])
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        obj = self._cut(context, request)
+        response = obj.import_credentials_csv()
+        self.assertEqual(response.content_type, 'text/csv')
+        body = u"user1;secret;user1@test.com;Dömmy;;\r\nuser2;secret2;;;;\r\n".encode('UTF-8')
+        self.assertEqual(response.body, body)
+        # an interrupted download can be started again
+        self.assertEqual(self._cut(context, request).import_credentials_csv().body, body)
+        self.assertFalse(get_import_progress(context, 'abc').cleared)
+
+    def test_import_credentials_csv_spooled(self):
+        from voteit.importparticipants.models import store_import_result
+        from voteit.importparticipants.parsing import Participant
+        context = self._meeting_fixture()
+        store_import_result(context, 'abc', [Participant(u'user1', u'secret', u'user1@test.com', u'Dömmy')],
+                            result_dir = self.result_dir)
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        response = self._cut(context, request).import_credentials_csv()
+        self.assertEqual(response.body, u"user1;secret;user1@test.com;Dömmy;;\r\n".encode('UTF-8'))
+
+
+    def test_import_credentials_csv_cleared(self):
+        from pyramid.httpexceptions import HTTPNotFound
+        from voteit.importparticipants.models import store_import_result
+        from voteit.importparticipants.parsing import Participant
+        context = self._meeting_fixture()
+        progress = store_import_result(context, 'abc', [Participant(u'user1', u'secret')], digest = 'digest')
+        progress.clear_results()
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        obj = self._cut(context, request)
+        self.assertRaises(HTTPNotFound, obj.import_credentials_csv)
+
+    def test_import_credentials_csv_expired(self):
+        from datetime import datetime
+        from datetime import timedelta
+        from pyramid.httpexceptions import HTTPNotFound
+        from voteit.importparticipants.models import store_import_result
+        from voteit.importparticipants.parsing import Participant
+        context = self._meeting_fixture()
+        progress = store_import_result(context, 'abc', [Participant(u'user1', u'secret')])
+        progress.finished = datetime.utcnow() - timedelta(hours = 25)
+        request = testing.DummyRequest(params = {'key': 'abc'})
+        obj = self._cut(context, request)
+        self.assertRaises(HTTPNotFound, obj.import_credentials_csv)
+
+    def test_import_report_csv(self):
+        from voteit.importparticipants.report import REPORT_SESSION_KEY
+        context = self._meeting_fixture()
+        request = testing.DummyRequest()
+        request.session[REPORT_SESSION_KEY] = [(2, 'userid', 'no_userid', u'2')]
+        obj = self._cut(context, request)
+        response = obj.import_report_csv()
+        self.assertEqual(response.body, "row;column;code;value\r\n2;userid;no_userid;2\r\n")
+
+    def test_import_multiple(self):
+        from voteit.importparticipants.parsing import parse_participants
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        context.__parent__['m2'] = other = Meeting()
+        obj = self._cut(context, self.request)
+        appstruct = {'roles': set([security.ROLE_VOTER]),
+                     'meetings': [{'meeting': 'm2', 'roles': set([security.ROLE_VIEWER])}]}
+        response = obj._import_multiple(appstruct, parse_participants(u"user1\nuser2"))
+        self.assertIn('2 participants added', response.body)
+        self.assertIn(security.ROLE_VOTER, context.get_groups('user1'))
+        self.assertIn(security.ROLE_VIEWER, other.get_groups('user2'))
+
+    def test_managed_meetings(self):
+        from voteit.importparticipants.schemas import managed_meetings
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        context = self._meeting_fixture()
+        context.__parent__['m2'] = other = Meeting()
+        self.assertEqual(managed_meetings(context, self.request), [('m2', other)])
+
+    def _json_request(self, data):
+        request = testing.DummyRequest()
+        request.content_type = 'application/json'
+        request.json_body = data
+        return request
+
+    def test_import_participants_json(self):
+        import json
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        request = self._json_request({'roles': [security.ROLE_VOTER],
+                                      'participants': [{'userid': u'user1', 'email': u'user1@test.com'},
+                                                       {'userid': u'user2', 'first_name': u'Dömmy'}]})
+        obj = self._cut(context, request)
+        response = obj.import_participants_json()
+        self.assertEqual(response.status_int, 200)
+        data = json.loads(response.body)
+        self.assertEqual([x['userid'] for x in data['results']], [u'user1', u'user2'])
+        self.assertEqual([x['row'] for x in data['results']], [1, 2])
+        self.assertEqual(data['results'][1]['first_name'], u'Dömmy')
+        self.assertEqual(len(data['results'][0]['password']), 10)
+        self.assertIn(security.ROLE_VOTER, context.get_groups('user1'))
+
+    def test_import_participants_json_invalid(self):
+        import json
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        request = self._json_request({'roles': [],
+                                      'participants': [{'userid': u'user1', 'email': u'bad'}, {}]})
+        obj = self._cut(context, request)
+        response = obj.import_participants_json()
+        self.assertEqual(response.status_int, 400)
+        data = json.loads(response.body)
+        self.assertEqual([(x['row'], x['code']) for x in data['errors']],
+                         [(1, 'invalid_email'), (2, 'no_userid')])
+        self.assertNotIn('user1', context.__parent__.users)
+
+    def test_import_participants_json_retry(self):
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        data = {'roles': [security.ROLE_VOTER], 'participants': [{'userid': u'user1'}]}
+        self._cut(context, self._json_request(data)).import_participants_json()
+        response = self._cut(context, self._json_request(data)).import_participants_json()
+        self.assertEqual(response.status_int, 409)
+        self.assertNotIn('user1-1', context.__parent__.users)
+        data['roles'] = [security.ROLE_VIEWER]
+        response = self._cut(context, self._json_request(data)).import_participants_json()
+        self.assertEqual(response.status_int, 409)
+
+    def test_import_participants_json_resumed(self):
+        import json
+        from datetime import datetime
+        from datetime import timedelta
+        from voteit.importparticipants.importer import import_key
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import parse_json_participants
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        rows = [{'userid': u'user1'}, {'userid': u'user2'}]
+        data = {'roles': [security.ROLE_VOTER], 'participants': rows}
+        digest = participants_digest(parse_json_participants(rows))
+        # the first row was committed before the earlier request was interrupted
+        self._cut(context, self._json_request({'roles': [security.ROLE_VOTER],
+                                               'participants': rows[:1]})).import_participants_json()
+        progress = get_import_progress(context, import_key(context, data['roles'], digest), create = True, digest = digest)
+        progress.cursor = 1
+        progress.started = datetime.utcnow()
+        response = self._cut(context, self._json_request(data)).import_participants_json()
+        self.assertEqual(response.status_int, 202)
+        progress.created = progress.started = datetime.utcnow() - timedelta(days = 1)
+        response = self._cut(context, self._json_request(data)).import_participants_json()
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual([x['userid'] for x in json.loads(response.body)['results']], [u'user2'])
+        self.assertTrue(progress.finished)
+        self.assertEqual(progress.result_count, 0)
+        self.assertNotIn('user1-1', context.__parent__.users)
+
+    def test_import_participants_json_wrong_content_type(self):
+        # like a form with enctype text/plain from another site
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        request = self._json_request({'roles': [security.ROLE_MODERATOR],
+                                      'participants': [{'userid': u'user1', 'password': u'known'}]})
+        request.content_type = 'text/plain'
+        obj = self._cut(context, request)
+        response = obj.import_participants_json()
+        self.assertEqual(response.status_int, 415)
+        self.assertNotIn('user1', context.__parent__.users)
+
+    def test_import_participants_json_bad_role(self):
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        request = self._json_request({'roles': ['role:Nonexistent'],
+                                      'participants': [{'userid': u'user1'}]})
+        obj = self._cut(context, request)
+        response = obj.import_participants_json()
+        self.assertEqual(response.status_int, 400)
+        self.assertIn('role:Nonexistent', response.body)
+
+    def test_import_participants_ndjson(self):
+        import json
+        from StringIO import StringIO
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        request = testing.DummyRequest()
+        request.content_type = 'application/x-ndjson'
+        request.GET = MultiDict([('roles', security.ROLE_VIEWER), ('roles', security.ROLE_VOTER)])
+        request.body_file_seekable = StringIO('{"userid": "user1", "password": "pw1"}\n\n{"userid": "user2"}\n')
+        obj = self._cut(context, request)
+        response = obj.import_participants_json()
+        self.assertEqual(response.content_type, 'application/x-ndjson')
+        results = [json.loads(x) for x in response.body.splitlines()]
+        self.assertEqual([(x['row'], x['userid']) for x in results], [(1, u'user1'), (3, u'user2')])
+        self.assertEqual(results[0]['password'], u'pw1')
+        self.assertIn(security.ROLE_VOTER, context.get_groups('user2'))
+
+    def test_import_participants_ndjson_bad_line(self):
+        from StringIO import StringIO
+        self.config.testing_securitypolicy(userid='admin', permissive=True)
+        self._tz_vc_fixture()
+        context = self._meeting_fixture()
+        request = testing.DummyRequest()
+        request.content_type = 'application/x-ndjson'
+        request.GET = MultiDict()
+        request.body_file_seekable = StringIO('{"userid": "user1"}\nnot json\n')
+        obj = self._cut(context, request)
+        response = obj.import_participants_json()
+        self.assertEqual(response.status_int, 400)
+        self.assertIn('Row 2', response.body)
+
+
+class _DummyUpload(object):
+    """ Behaves like the cgi.FieldStorage of an uploaded file. """
+
+    def __init__(self, value, filename = 'participants.csv'):
+        from StringIO import StringIO
+        self.file = StringIO(value.encode('UTF-8'))
+        self.filename = filename
+        self.type = 'text/csv'
+        self.length = len(self.file.getvalue())
          
         
 class CSVParticipantValidatorTests(unittest.TestCase):
@@ -267,9 +821,1000 @@ class CSVParticipantValidatorTests(unittest.TestCase):
         node = None
         self.assertRaises(colander.Invalid, obj, node, u"user1;tester@voteit.se;Dummy;User\n")
     
+    def test_not_unique_email_other_case(self):
+        context = self._fixture()
+        api = self._api(context)
+        obj = self._cut(context, api)
+        node = None
+        self.assertRaises(colander.Invalid, obj, node, u"user1;password1;Tester@VoteIT.se;Dummy;User\n")
+
+    def test_duplicate_email_in_batch(self):
+        context = self._fixture()
+        api = self._api(context)
+        obj = self._cut(context, api)
+        node = None
+        self.assertRaises(colander.Invalid, obj, node, u"user1;;same@test.com\nuser2;;Same@test.com\n")
+
+    def test_build_email_index(self):
+        from voteit.importparticipants.validators import build_email_index
+        context = self._fixture()
+        users = context.__parent__.users
+        index = build_email_index(users)
+        self.assertEqual(index[u'tester@voteit.se'], u'tester')
+        self.assertEqual(index[u'moderator@voteit.se'], u'moderator')
+
+    def test_good_parsed(self):
+        from voteit.importparticipants.parsing import parse_participants
+        context = self._fixture()
+        api = self._api(context)
+        obj = self._cut(context, api)
+        node = None
+        obj(node, parse_participants(u"user1;password1;user1@test.com;Dummy;User\n"))
+
+    def test_file_good(self):
+        from StringIO import StringIO
+        from voteit.importparticipants.validators import CSVFileParticipantValidator
+        context = self._fixture()
+        api = self._api(context)
+        obj = CSVFileParticipantValidator(context, api)
+        fp = StringIO(u"user1;password1;user1@test.com;Dömmy;User\n".encode('UTF-8'))
+        obj(None, {'fp': fp})
+        self.assertEqual(fp.tell(), 0)
+
+    def test_file_not_unique_username(self):
+        from StringIO import StringIO
+        from voteit.importparticipants.validators import CSVFileParticipantValidator
+        context = self._fixture()
+        api = self._api(context)
+        obj = CSVFileParticipantValidator(context, api)
+        fp = StringIO("user1\ntester\n")
+        self.assertRaises(colander.Invalid, obj, None, {'fp': fp})
+
+    def test_file_xlsx(self):
+        from voteit.importparticipants.validators import CSVFileParticipantValidator
+        context = self._fixture()
+        api = self._api(context)
+        obj = CSVFileParticipantValidator(context, api)
+        fp = _xlsx([(1, [('A', u'userid'), ('B', u'email')]),
+                    (2, [('A', u'user1'), ('B', u'tester@voteit.se')])])
+        try:
+            obj(None, {'fp': fp, 'filename': 'roster.xlsx'})
+        except colander.Invalid, exc:
+            self.assertIn(u'tester@voteit.se', exc.msg)
+        else:
+            self.fail("registered email not found")
+        self.assertEqual(fp.tell(), 0)
+
+    def test_file_unreadable(self):
+        from StringIO import StringIO
+        from voteit.importparticipants.validators import CSVFileParticipantValidator
+        context = self._fixture()
+        api = self._api(context)
+        obj = CSVFileParticipantValidator(context, api)
+        self.assertRaises(colander.Invalid, obj, None, {'fp': StringIO("user1"), 'filename': 'roster.xlsx'})
+
+    def _roles_request(self, *roles):
+        controls = [('__start__', 'roles:sequence')]
+        controls.extend(('checkbox', x) for x in roles)
+        controls.append(('__end__', 'roles:sequence'))
+        return testing.DummyRequest(post = MultiDict(controls))
+
+    def _committed_fixture(self, context, roster, roles, cursor):
+        from voteit.importparticipants.importer import import_key
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import parse_participants
+        participants = parse_participants(roster)
+        digest = participants_digest(participants)
+        progress = get_import_progress(context, import_key(context, roles, digest), create = True, digest = digest)
+        progress.cursor = cursor
+        return participants
+
+    def test_resumed_import_skips_committed_rows(self):
+        from voteit.importparticipants.validators import CSVParticipantValidator
+        context = self._fixture()
+        participants = self._committed_fixture(context, u"tester\nuser1\n", (security.ROLE_VOTER, ), 1)
+        api = self._api(context, self._roles_request(security.ROLE_VOTER))
+        obj = CSVParticipantValidator(context, api, resume = True)
+        obj(None, participants)
+
+    def test_committed_rows_other_roles_checked(self):
+        from voteit.importparticipants.validators import CSVParticipantValidator
+        context = self._fixture()
+        participants = self._committed_fixture(context, u"tester\nuser1\n", (security.ROLE_VOTER, ), 1)
+        api = self._api(context, self._roles_request(security.ROLE_VIEWER))
+        obj = CSVParticipantValidator(context, api, resume = True)
+        self.assertRaises(colander.Invalid, obj, None, participants)
+
+    def test_committed_rows_checked_without_resume(self):
+        context = self._fixture()
+        participants = self._committed_fixture(context, u"tester\nuser1\n", (security.ROLE_VOTER, ), 1)
+        api = self._api(context, self._roles_request(security.ROLE_VOTER))
+        obj = self._cut(context, api)
+        self.assertRaises(colander.Invalid, obj, None, participants)
+
+    def test_sync_slugified_userid(self):
+        from voteit.importparticipants.validators import CSVParticipantValidator
+        context = self._fixture()
+        context.__parent__.users['anna-b'] = User(email = u"anna@test.com")
+        api = self._api(context)
+        obj = CSVParticipantValidator(context, api, sync = True)
+        # the same user, so the email isn't registered to someone else
+        obj(None, u"anna_b;;anna@test.com\n")
+
+    def test_empty_row(self):
+        context = self._fixture()
+        api = self._api(context)
+        obj = self._cut(context, api)
+        node = None
+        self.assertRaises(colander.Invalid, obj, node, u"user1\n\nuser2")
+
+    def test_report(self):
+        from voteit.importparticipants.report import REPORT_SESSION_KEY
+        context = self._fixture()
+        api = self._api(context)
+        obj = self._cut(context, api)
+        node = None
+        try:
+            obj(node, u"user1;;bad\ntester\n;;\nuser4;;tester@voteit.se\n")
+        except colander.Invalid, exc:
+            self.assertIn('import_report.csv', exc.msg)
+        else:
+            self.fail("Invalid not raised")
+        self.assertEqual(api.request.session[REPORT_SESSION_KEY],
+                         [(1, 'email', 'invalid_email', u'bad'),
+                          (2, 'userid', 'registered_userid', u'tester'),
+                          (3, 'userid', 'no_userid', u'3'),
+                          (4, 'email', 'registered_email', u'tester@voteit.se')])
+
+    def test_report_limit(self):
+        from voteit.importparticipants.report import REPORT_SESSION_KEY
+        context = self._fixture()
+        api = self._api(context)
+        self.config.registry.settings['voteit.importparticipants.max_errors'] = '5'
+        obj = self._cut(context, api)
+        node = None
+        value = u"\n".join([u"User%s" % n for n in range(100)])
+        self.assertRaises(colander.Invalid, obj, node, value)
+        self.assertEqual(len(api.request.session[REPORT_SESSION_KEY]), 5)
+
     def test_bad_csv_wrong_delimiter(self):
         context = self._fixture()
         api = self._api(context)
         obj = self._cut(context, api)
         node = None
         self.assertRaises(colander.Invalid, obj, node, u"user1,pwd,user1@test.com,Dummy,User\n")
+
+    def test_sync_existing_user(self):
+        from voteit.importparticipants.validators import CSVParticipantValidator
+        context = self._fixture()
+        api = self._api(context)
+        obj = CSVParticipantValidator(context, api, sync = True)
+        obj(None, u"tester;;tester@voteit.se\nuser1;;user1@test.com\n")
+
+    def test_sync_email_of_other_user(self):
+        from voteit.importparticipants.validators import CSVParticipantValidator
+        context = self._fixture()
+        api = self._api(context)
+        obj = CSVParticipantValidator(context, api, sync = True)
+        report = obj.check(self._parse(u"tester;;moderator@voteit.se\n"))
+        self.assertEqual([x[2] for x in report.entries], ['registered_email'])
+
+    def test_invalid_role(self):
+        context = self._fixture()
+        api = self._api(context)
+        obj = self._cut(context, api)
+        report = obj.check(self._parse(u"user1;;;;;Voter\nuser2;;;;;Voter,Emperor\n"))
+        self.assertEqual(report.entries, [(2, 'roles', 'invalid_role', u'role:Emperor')])
+
+    def _parse(self, value):
+        from voteit.importparticipants.parsing import parse_participants
+        return parse_participants(value)
+
+
+class ParseParticipantsTests(unittest.TestCase):
+
+    @property
+    def _fut(self):
+        from voteit.importparticipants.parsing import parse_participants
+        return parse_participants
+
+    def test_full_row(self):
+        output = self._fut(u"user1;password1;user1@test.com;Dömmy;用户\n")
+        self.assertEqual(len(output), 1)
+        self.assertEqual(output[0].userid, u"user1")
+        self.assertEqual(output[0].password, u"password1")
+        self.assertEqual(output[0].email, u"user1@test.com")
+        self.assertEqual(output[0].first_name, u"Dömmy")
+        self.assertEqual(output[0].last_name, u"用户")
+
+    def test_short_row(self):
+        output = self._fut(u"user1\nuser2;pw")
+        self.assertEqual(len(output), 2)
+        self.assertEqual(output[0].password, u"")
+        self.assertEqual(output[1].password, u"pw")
+        self.assertEqual(output[1].last_name, u"")
+
+    def test_empty_row(self):
+        output = self._fut(u"user1\n\nuser2")
+        self.assertEqual([x.userid for x in output], [u"user1", u"", u"user2"])
+        self.assertEqual([x.row for x in output], [1, 2, 3])
+
+    def test_iter_csv_round_trip(self):
+        from voteit.importparticipants.parsing import iter_csv
+        participants = self._fut(u"user1;pw;a@b.com;Dömmy;\"Semi;colon\"\nuser2")
+        output = self._fut("".join(iter_csv(participants)).decode('UTF-8'))
+        self.assertEqual([x.values() for x in output], [x.values() for x in participants])
+
+    def test_from_dict(self):
+        from voteit.importparticipants.parsing import Participant
+        obj = Participant.from_dict({'userid': u'user1', 'email': None, 'last_name': 5}, row = 3)
+        self.assertEqual(obj.values(), (u'user1', u'', u'', u'', u'5', u''))
+        self.assertEqual(obj.row, 3)
+        self.assertRaises(ValueError, Participant.from_dict, [u'user1'])
+
+    def test_roles_column(self):
+        output = self._fut(u"user1;;;;;Voter, role:Viewer\nuser2")
+        self.assertEqual(output[0].get_roles(), (u'role:Voter', u'role:Viewer'))
+        self.assertEqual(output[1].get_roles((security.ROLE_VIEWER, )), (security.ROLE_VIEWER, ))
+
+    def test_from_dict_roles_list(self):
+        from voteit.importparticipants.parsing import Participant
+        obj = Participant.from_dict({'userid': u'user1', 'roles': [u'role:Voter', u'Viewer']})
+        self.assertEqual(obj.get_roles(), (u'role:Voter', u'role:Viewer'))
+
+    def test_header_row(self):
+        output = self._fut(u"E-mail;User ID;Phone;First name\nuser1@test.com;user1;555;Dömmy\n")
+        self.assertEqual(len(output), 1)
+        self.assertEqual(output[0].values(), (u'user1', u'', u'user1@test.com', u'Dömmy', u'', u''))
+        self.assertEqual(output[0].row, 2)
+
+    def test_no_header_row(self):
+        output = self._fut(u"login;;login@test.com;Login;Name\n")
+        self.assertEqual(output[0].userid, u'login')
+
+    def test_data_rows_that_look_like_headers(self):
+        output = self._fut(u"login;;login@example.com\nuser2\n")
+        self.assertEqual([x.userid for x in output], [u'login', u'user2'])
+        output = self._fut(u"username;;;Anna\nuser2\n")
+        self.assertEqual([(x.userid, x.first_name) for x in output], [(u'username', u'Anna'), (u'user2', u'')])
+
+    def _file(self, value):
+        from StringIO import StringIO
+        from voteit.importparticipants.parsing import iter_participants
+        return list(iter_participants(StringIO(value.encode('UTF-8'))))
+
+    def test_comma_delimiter(self):
+        output = self._file(u"userid,email,last_name\nuser1,user1@test.com,\"Smith, Jr\"\nuser2,user2@test.com,Jones\n")
+        self.assertEqual([(x.userid, x.email, x.last_name) for x in output],
+                         [(u'user1', u'user1@test.com', u'Smith, Jr'), (u'user2', u'user2@test.com', u'Jones')])
+
+    def test_tab_delimiter(self):
+        output = self._file(u"user1\t\tuser1@test.com\tDömmy\nuser2\t\tuser2@test.com\tUser\n")
+        self.assertEqual([x.first_name for x in output], [u'Dömmy', u'User'])
+
+    def test_pasted_csv_is_semicolon_separated(self):
+        output = self._fut(u"anna;;;;;Voter,Discussion\nbob;;bob@test.com;Bob;Berg, Jr\n")
+        self.assertEqual([(x.userid, x.last_name, x.roles) for x in output],
+                         [(u'anna', u'', u'Voter,Discussion'), (u'bob', u'Berg, Jr', u'')])
+
+    def test_file_prefers_semicolon(self):
+        output = self._file(u"anna;;;;;Voter,Discussion\nbob;;;;;Voter,Viewer\n")
+        self.assertEqual([(x.userid, x.roles) for x in output],
+                         [(u'anna', u'Voter,Discussion'), (u'bob', u'Voter,Viewer')])
+
+    def test_file_byte_order_mark(self):
+        from StringIO import StringIO
+        from voteit.importparticipants.parsing import iter_participants
+        fp = StringIO(u"\ufeffUserID;Email;First name\nanna;anna@test.com;Anna\n".encode('UTF-8'))
+        output = list(iter_participants(fp))
+        self.assertEqual([x.values() for x in output], [(u'anna', u'', u'anna@test.com', u'Anna', u'', u'')])
+
+    def test_iter_ndjson_participants(self):
+        from StringIO import StringIO
+        from voteit.importparticipants.parsing import iter_ndjson_participants
+        fp = StringIO('{"userid": "user1", "first_name": "D\\u00f6mmy"}\n\n{"userid": "user2"}')
+        output = list(iter_ndjson_participants(fp))
+        self.assertEqual([(x.row, x.userid) for x in output], [(1, u'user1'), (3, u'user2')])
+        self.assertEqual(output[0].first_name, u'Dömmy')
+
+
+class ParticipantsCSVTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.schemas import ParticipantsCSV
+        return ParticipantsCSV
+
+    def test_deserialize(self):
+        node = colander.SchemaNode(self._cut())
+        output = node.deserialize(u"user1;password1\nuser2")
+        self.assertEqual([x.userid for x in output], [u"user1", u"user2"])
+
+    def test_deserialize_html(self):
+        node = colander.SchemaNode(self._cut())
+        self.assertRaises(colander.Invalid, node.deserialize, u"user1;<script>alert('x')</script>")
+
+
+class ParticipantImporterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request = self.request)
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.importer import ParticipantImporter
+        return ParticipantImporter
+
+    def _meeting_fixture(self):
+        root = bootstrap_and_fixture(self.config)
+        root['m'] = meeting = Meeting()
+        return meeting
+
+    def _participants(self, count):
+        from voteit.importparticipants.parsing import parse_participants
+        return parse_participants(u"\n".join([u"user%s;;user%s@test.com" % (n, n) for n in range(1, count + 1)]))
+
+    def test_call(self):
+        meeting = self._meeting_fixture()
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        output = obj(self._participants(2))
+        self.assertEqual([x.userid for x in output], [u'user1', u'user2'])
+        self.assertIn('user2', meeting.__parent__.users)
+        self.assertIn(security.ROLE_VOTER, meeting.get_groups('user2'))
+
+    def test_import_chunked_results(self):
+        from voteit.core.models.interfaces import IMeeting
+        from voteit.importparticipants.interfaces import IParticipantsImportedEvent
+        from voteit.importparticipants.models import get_import_progress
+        events = []
+        self.config.add_subscriber(lambda obj, event: events.append(event), (IMeeting, IParticipantsImportedEvent))
+        meeting = self._meeting_fixture()
+        progress = get_import_progress(meeting, 'key', create = True)
+        results = []
+        class _Results(object):
+            add = results.append
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        obj.batch_size = 2
+        obj.import_chunked(self._participants(3), progress, 0, results = _Results())
+        self.assertEqual([x.userid for x in results], [u'user1', u'user2', u'user3'])
+        self.assertEqual(progress.cursor, 3)
+        self.assertEqual(progress.result_count, 0)
+        self.assertIn('user3', meeting.__parent__.users)
+        self.assertEqual([len(x.userids) for x in events], [2, 1])
+
+    def test_import_chunked(self):
+        from voteit.importparticipants.models import get_import_progress
+        meeting = self._meeting_fixture()
+        progress = get_import_progress(meeting, 'key', create = True)
+        commits = []
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        result = obj.import_chunked(self._participants(5), progress, 2, commit = lambda: commits.append(progress.cursor))
+        self.assertEqual(commits, [2, 4])
+        self.assertEqual(result, progress)
+        self.assertEqual(progress.cursor, 5)
+        self.assertEqual(len(progress.get_participants()), 5)
+
+    def test_import_chunked_without_commits(self):
+        from voteit.importparticipants.models import get_import_progress
+        meeting = self._meeting_fixture()
+        progress = get_import_progress(meeting, 'key', create = True)
+        commits = []
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        obj.batch_size = 2
+        obj.import_chunked(self._participants(5), progress, 0, commit = lambda: commits.append(progress.cursor))
+        self.assertEqual(commits, [])
+        self.assertEqual([x.userid for x in progress.iter_participants()],
+                         [u'user1', u'user2', u'user3', u'user4', u'user5'])
+
+    def test_import_chunked_resume(self):
+        from voteit.importparticipants.models import get_import_progress
+        meeting = self._meeting_fixture()
+        progress = get_import_progress(meeting, 'key', create = True)
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        obj.import_chunked(self._participants(2), progress, 2, commit = lambda: None)
+        # Simulate an attempt that was aborted after the first chunk
+        obj.import_chunked(self._participants(3), progress, 2, commit = lambda: None)
+        self.assertEqual([x.userid for x in progress.iter_participants()], [u'user1', u'user2', u'user3'])
+        self.assertNotIn('user1-1', meeting.__parent__.users)
+
+    def test_get_chunk_size(self):
+        from voteit.importparticipants.importer import get_chunk_size
+        self.assertEqual(get_chunk_size(self.config.registry), 0)
+        self.config.registry.settings['voteit.importparticipants.chunk_size'] = '500'
+        self.assertEqual(get_chunk_size(self.config.registry), 500)
+
+    def test_participants_digest(self):
+        from voteit.importparticipants.importer import participants_digest
+        self.assertEqual(participants_digest(self._participants(3)), participants_digest(self._participants(3)))
+        self.assertNotEqual(participants_digest(self._participants(3)), participants_digest(self._participants(2)))
+
+    def test_import_key(self):
+        from voteit.importparticipants.importer import import_key
+        meeting = self._meeting_fixture()
+        meeting.__parent__['m2'] = other = Meeting()
+        key = import_key(meeting, (security.ROLE_VOTER, security.ROLE_VIEWER), 'abc')
+        self.assertEqual(key, import_key(meeting, (security.ROLE_VIEWER, security.ROLE_VOTER), 'abc'))
+        self.assertNotEqual(key, import_key(meeting, (security.ROLE_VOTER, ), 'abc'))
+        self.assertNotEqual(key, import_key(other, (security.ROLE_VOTER, security.ROLE_VIEWER), 'abc'))
+        self.assertNotEqual(key, import_key(meeting, (security.ROLE_VOTER, security.ROLE_VIEWER), 'abd'))
+
+    def test_participants_digest_normalized(self):
+        from voteit.importparticipants.importer import participants_digest
+        from voteit.importparticipants.parsing import parse_participants
+        self.assertEqual(participants_digest(parse_participants(u"user1;;user1@test.com")),
+                         participants_digest(parse_participants(u" user1 ;;User1@Test.com ")))
+
+    def test_one_event_per_batch(self):
+        from voteit.core.models.interfaces import IMeeting
+        from voteit.importparticipants.interfaces import IParticipantsImportedEvent
+        events = []
+        self.config.add_subscriber(lambda obj, event: events.append(event), (IMeeting, IParticipantsImportedEvent))
+        meeting = self._meeting_fixture()
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        obj(self._participants(3))
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].object, meeting)
+        self.assertEqual(events[0].userids, (u'user1', u'user2', u'user3'))
+
+    def test_roles_column(self):
+        from voteit.core.models.interfaces import IMeeting
+        from voteit.importparticipants.interfaces import IParticipantsImportedEvent
+        from voteit.importparticipants.parsing import parse_participants
+        events = []
+        self.config.add_subscriber(lambda obj, event: events.append(event), (IMeeting, IParticipantsImportedEvent))
+        meeting = self._meeting_fixture()
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        obj(parse_participants(u"user1\nuser2;;;;;Moderator\nuser3;;;;;Moderator"))
+        self.assertEqual(set(meeting.get_groups('user1')), set([security.ROLE_VOTER]))
+        self.assertEqual(set(meeting.get_groups('user2')), set([security.ROLE_MODERATOR]))
+        self.assertEqual(sorted((x.roles, x.userids) for x in events),
+                         [((u'role:Moderator', ), (u'user2', u'user3')),
+                          ((security.ROLE_VOTER, ), (u'user1', ))])
+
+    def test_several_meetings(self):
+        from voteit.core.models.interfaces import IMeeting
+        from voteit.importparticipants.interfaces import IParticipantsImportedEvent
+        events = []
+        self.config.add_subscriber(lambda obj, event: events.append(event), (IMeeting, IParticipantsImportedEvent))
+        meeting = self._meeting_fixture()
+        meeting.__parent__['m2'] = other = Meeting()
+        obj = self._cut(meeting, (security.ROLE_VOTER, ), meetings = [(other, (security.ROLE_VIEWER, ))])
+        output = obj(self._participants(2))
+        self.assertEqual(len(output), 2)
+        self.assertEqual(len(meeting.__parent__.users), 2 + 1)
+        self.assertIn(security.ROLE_VOTER, meeting.get_groups('user2'))
+        self.assertEqual(set(other.get_groups('user2')), set([security.ROLE_VIEWER]))
+        self.assertEqual([(x.object, x.roles) for x in events],
+                         [(meeting, (security.ROLE_VOTER, )), (other, (security.ROLE_VIEWER, ))])
+
+    def test_one_event_per_chunk(self):
+        from voteit.core.models.interfaces import IMeeting
+        from voteit.importparticipants.interfaces import IParticipantsImportedEvent
+        from voteit.importparticipants.models import get_import_progress
+        events = []
+        self.config.add_subscriber(lambda obj, event: events.append(event), (IMeeting, IParticipantsImportedEvent))
+        meeting = self._meeting_fixture()
+        progress = get_import_progress(meeting, 'key', create = True)
+        obj = self._cut(meeting, (security.ROLE_VOTER, ))
+        obj.import_chunked(self._participants(3), progress, 2, commit = lambda: None)
+        self.assertEqual([len(x.userids) for x in events], [2, 1])
+
+    def test_defer_indexing(self):
+        from repoze.folder.interfaces import IObjectAddedEvent
+        from repoze.folder.interfaces import IObjectWillBeAddedEvent
+        from voteit.core.models.interfaces import IUser
+        meeting = self._meeting_fixture()
+        root = meeting.__parent__
+        will_be_added = []
+        added = []
+        self.config.add_subscriber(lambda obj, event: will_be_added.append(event), (IUser, IObjectWillBeAddedEvent))
+        self.config.add_subscriber(lambda obj, event: added.append(event), (IUser, IObjectAddedEvent))
+        obj = self._cut(meeting, (security.ROLE_VOTER, ), defer_indexing = True)
+        obj.import_participant(self._participants(1)[0])
+        self.assertEqual([x.object for x in will_be_added], [root.users['user1']])
+        self.assertEqual(added, [])
+        obj.index_pending()
+        self.assertEqual([(x.object, x.parent, x.name) for x in added], [(root.users['user1'], root.users, 'user1')])
+        self.assertIn('create', obj.timings)
+        self.assertIn('index', obj.timings)
+
+    def test_hasher(self):
+        from voteit.importparticipants.hashing import PasswordHasher
+        meeting = self._meeting_fixture()
+        hasher = PasswordHasher(2)
+        try:
+            obj = self._cut(meeting, (security.ROLE_VOTER, ), hasher = hasher)
+            output = obj(self._participants(3))
+            # the pool is shared, so it's still running after the import
+            self.assertNotEqual(hasher.pool, None)
+        finally:
+            hasher.close()
+        users = meeting.__parent__.users
+        for participant in output:
+            pw_field = users[participant.userid].get_custom_field('password')
+            self.assertTrue(pw_field.check_input(participant.password))
+
+    def test_report_timings(self):
+        from voteit.importparticipants.instrumentation import ImportInstrumentation
+        records = []
+        instrumentation = ImportInstrumentation()
+        instrumentation.subscribe(records.append)
+        meeting = self._meeting_fixture()
+        obj = self._cut(meeting, (security.ROLE_VOTER, ), instrumentation = instrumentation)
+        obj(self._participants(2))
+        phases = dict((x['phase'], x) for x in records)
+        self.assertIn('userid', phases)
+        self.assertIn('create', phases)
+        self.assertIn('groups', phases)
+        self.assertEqual(phases['create']['rows'], 2)
+
+    def test_get_defer_indexing(self):
+        from voteit.importparticipants.importer import get_defer_indexing
+        self.assertEqual(get_defer_indexing(self.config.registry), False)
+        self.config.registry.settings['voteit.importparticipants.defer_indexing'] = 'true'
+        self.assertEqual(get_defer_indexing(self.config.registry), True)
+
+
+class ImportInstrumentationTests(unittest.TestCase):
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.instrumentation import ImportInstrumentation
+        return ImportInstrumentation
+
+    def test_emit(self):
+        records = []
+        obj = self._cut()
+        obj.subscribe(records.append)
+        obj.emit('parse', 1.5, rows = 10, extra = 1)
+        self.assertEqual(records, [{'phase': 'parse', 'seconds': 1.5, 'rows': 10, 'extra': 1}])
+
+    def test_phase(self):
+        records = []
+        obj = self._cut()
+        obj.subscribe(records.append)
+        with obj.phase('parse') as record:
+            record['rows'] = 3
+        self.assertEqual(records[0]['phase'], 'parse')
+        self.assertEqual(records[0]['rows'], 3)
+        self.assertTrue(records[0]['seconds'] >= 0)
+
+    def test_phase_exception(self):
+        records = []
+        obj = self._cut()
+        obj.subscribe(records.append)
+        def _fail():
+            with obj.phase('parse'):
+                raise ValueError()
+        self.assertRaises(ValueError, _fail)
+        self.assertEqual(len(records), 1)
+
+    def test_includeme(self):
+        from voteit.importparticipants.instrumentation import get_instrumentation
+        from voteit.importparticipants.instrumentation import log_phase
+        config = testing.setUp()
+        try:
+            config.include('voteit.importparticipants.instrumentation')
+            self.assertIn(log_phase, get_instrumentation(config.registry).subscribers)
+        finally:
+            testing.tearDown()
+
+
+class CredentialGeneratorTests(unittest.TestCase):
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.credentials import CredentialGenerator
+        return CredentialGenerator
+
+    def test_generate(self):
+        from voteit.importparticipants.credentials import _PW_CHARS
+        obj = self._cut()
+        output = obj.generate(1000)
+        self.assertEqual(len(output), 1000)
+        self.assertEqual(len(set(output)), 1000)
+        for password in output:
+            self.assertEqual(len(password), 10)
+            self.assertFalse(set(password) - set(_PW_CHARS))
+
+    def test_generate_custom(self):
+        obj = self._cut(length = 4, alphabet = 'ab')
+        output = obj.generate(16)
+        self.assertEqual(len(set(output)), 16)
+        self.assertEqual(set("".join(output)), set('ab'))
+
+    def test_includeme(self):
+        from voteit.importparticipants.interfaces import ICredentialGenerator
+        config = testing.setUp(settings = {'voteit.importparticipants.password_length': '14'})
+        try:
+            config.include('voteit.importparticipants.credentials')
+            generator = config.registry.getUtility(ICredentialGenerator)
+            self.assertEqual(len(generator.generate(1)[0]), 14)
+        finally:
+            testing.tearDown()
+
+
+class PasswordHasherTests(unittest.TestCase):
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.hashing import PasswordHasher
+        return PasswordHasher
+
+    def test_hash(self):
+        from betahaus.pyracont.fields.password import get_sha_password
+        obj = self._cut(2, hash_method = get_sha_password)
+        try:
+            output = obj([u"password%s" % x for x in range(10)])
+        finally:
+            obj.close()
+        self.assertEqual(output, [get_sha_password(u"password%s" % x) for x in range(10)])
+
+    def test_set_prehashed_password(self):
+        from betahaus.pyracont.fields.password import PasswordField
+        from betahaus.pyracont.fields.password import get_sha_password
+        from voteit.importparticipants.hashing import set_prehashed_password
+        field = PasswordField()
+        user = testing.DummyResource(get_custom_field = lambda name: field)
+        set_prehashed_password(user, get_sha_password(u"secret"), get_sha_password)
+        self.assertTrue(field.check_input(u"secret"))
+        self.assertRaises(ValueError, set_prehashed_password, user, u"hash", lambda x: u"hash")
+
+    def test_includeme(self):
+        from voteit.importparticipants.hashing import get_password_hasher
+        from voteit.importparticipants.hashing import includeme
+        config = testing.setUp()
+        try:
+            includeme(config)
+            self.assertEqual(get_password_hasher(config.registry), None)
+            config.registry.settings['voteit.importparticipants.hash_processes'] = '2'
+            includeme(config)
+            hasher = get_password_hasher(config.registry)
+            try:
+                self.assertEqual(hasher.processes, 2)
+                self.assertNotEqual(hasher.pool, None)
+            finally:
+                hasher.close()
+        finally:
+            testing.tearDown()
+
+    def test_get_hash_processes(self):
+        from voteit.importparticipants.hashing import get_hash_processes
+        config = testing.setUp()
+        try:
+            self.assertEqual(get_hash_processes(config.registry), 0)
+            config.registry.settings['voteit.importparticipants.hash_processes'] = '4'
+            self.assertEqual(get_hash_processes(config.registry), 4)
+        finally:
+            testing.tearDown()
+
+
+class ImportProgressTests(unittest.TestCase):
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.models import ImportProgress
+        return ImportProgress
+
+    def test_eta(self):
+        from datetime import datetime
+        from datetime import timedelta
+        obj = self._cut('key', total = 100)
+        self.assertEqual(obj.eta(), None)
+        now = datetime.utcnow()
+        obj.started = now - timedelta(seconds = 10)
+        obj.cursor = 20
+        self.assertEqual(obj.eta(now = now), 40)
+        obj.finished = now
+        self.assertEqual(obj.eta(), 0)
+
+    def test_add_error(self):
+        obj = self._cut('key')
+        obj.add_error(u"Error")
+        self.assertEqual(obj.as_dict()['errors'], [u"Error"])
+
+    def test_expire_import_results(self):
+        from datetime import datetime
+        from datetime import timedelta
+        from voteit.importparticipants.models import expire_import_results
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.models import store_import_result
+        from voteit.importparticipants.parsing import Participant
+        meeting = testing.DummyResource()
+        now = datetime.utcnow()
+        old = store_import_result(meeting, 'old', [Participant(u'user1', u'secret')], digest = 'a')
+        old.finished = now - timedelta(hours = 2)
+        anonymous = store_import_result(meeting, 'anonymous', [Participant(u'user2', u'secret')])
+        anonymous.finished = now - timedelta(hours = 2)
+        recent = store_import_result(meeting, 'recent', [Participant(u'user3', u'secret')], digest = 'b')
+        running = get_import_progress(meeting, 'running', create = True)
+        running.add(Participant(u'user4', u'secret'))
+        abandoned = get_import_progress(meeting, 'abandoned', create = True, digest = 'c')
+        abandoned.add(Participant(u'user5', u'secret'))
+        abandoned.cursor = 1
+        abandoned.created = abandoned.updated = now - timedelta(hours = 2)
+        self.assertEqual(expire_import_results(meeting, timedelta(hours = 1), now = now), 3)
+        self.assertTrue(old.cleared)
+        self.assertEqual(old.result_count, 0)
+        self.assertEqual(get_import_progress(meeting, 'anonymous'), None)
+        self.assertFalse(recent.cleared)
+        self.assertEqual(running.result_count, 1)
+        # still resumable
+        self.assertEqual((abandoned.result_count, abandoned.cursor), (0, 1))
+
+    def test_spool_results(self):
+        import os
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        from voteit.importparticipants.parsing import Participant
+        result_dir = mkdtemp()
+        try:
+            obj = self._cut('key')
+            obj.spool_results(result_dir)
+            obj.add(Participant(u'user1', u'sécret'))
+            committed = obj.result_size
+            obj.add(Participant(u'user2', u'aborted'))
+            # the transaction of user2 was aborted
+            obj.result_size = committed
+            obj.result_count = 1
+            obj.add(Participant(u'user3', u'a;b'))
+            self.assertEqual(len(obj.results), 0)
+            self.assertEqual([(x.userid, x.password) for x in obj.iter_participants()],
+                             [(u'user1', u'sécret'), (u'user3', u'a;b')])
+            path = obj.result_path
+            obj.clear_results()
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(obj.get_participants(), [])
+        finally:
+            rmtree(result_dir)
+
+    def test_get_result_max_age(self):
+        from datetime import timedelta
+        from voteit.importparticipants.models import get_result_max_age
+        config = testing.setUp()
+        try:
+            self.assertEqual(get_result_max_age(config.registry), timedelta(hours = 24))
+            config.registry.settings['voteit.importparticipants.result_max_age'] = '2'
+            self.assertEqual(get_result_max_age(config.registry), timedelta(hours = 2))
+        finally:
+            testing.tearDown()
+
+    def test_is_stale(self):
+        from datetime import datetime
+        from datetime import timedelta
+        now = datetime.utcnow()
+        obj = self._cut('key')
+        obj.queued = now - timedelta(minutes = 20)
+        self.assertTrue(obj.is_stale(timedelta(minutes = 10), now = now))
+        obj.updated = now - timedelta(minutes = 1)
+        self.assertFalse(obj.is_stale(timedelta(minutes = 10), now = now))
+        # queued again after an update long ago
+        obj.updated = now - timedelta(minutes = 30)
+        obj.queued = now
+        self.assertFalse(obj.is_stale(timedelta(minutes = 10), now = now))
+
+    def test_results(self):
+        from voteit.importparticipants.parsing import Participant
+        obj = self._cut('key')
+        for n in range(5):
+            obj.add(Participant(u'user%s' % n, u'secret'))
+        self.assertEqual(obj.result_count, 5)
+        self.assertEqual([x.userid for x in obj.get_participants(limit = 2)], [u'user0', u'user1'])
+        self.assertEqual(len(list(obj.iter_participants())), 5)
+        obj.clear_results()
+        self.assertEqual(obj.result_count, 0)
+        self.assertEqual(obj.get_participants(), [])
+        self.assertTrue(obj.cleared)
+
+    def test_chunk_commits_dont_rewrite_results(self):
+        import os
+        import shutil
+        import tempfile
+        import transaction
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+        from voteit.importparticipants.parsing import Participant
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'Data.fs')
+            db = DB(FileStorage(path))
+            tm = transaction.TransactionManager()
+            conn = db.open(transaction_manager = tm)
+            conn.root()['progress'] = obj = self._cut('key')
+            tm.commit()
+            growth = []
+            for chunk in range(20):
+                size = os.path.getsize(path)
+                for n in range(100):
+                    obj.add(Participant(u'user%s-%s' % (chunk, n), u'secret'))
+                tm.commit()
+                growth.append(os.path.getsize(path) - size)
+            # every commit writes about the same amount, not everything stored so far
+            self.assertTrue(growth[-1] < growth[1] * 2)
+            conn.close()
+            db.close()
+        finally:
+            shutil.rmtree(tmp)
+
+
+class ImportJobTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.jobs import ImportJob
+        return ImportJob
+
+    def _fixture(self):
+        import transaction
+        from ZODB import DB
+        root = bootstrap_and_fixture(self.config)
+        root['m'] = meeting = Meeting()
+        self.db = DB(None)
+        tm = transaction.TransactionManager()
+        conn = self.db.open(transaction_manager = tm)
+        conn.root()['app'] = root
+        tm.commit()
+        self.addCleanup(self.db.close)
+        return (conn, tm, meeting)
+
+    def test_failed_job_can_be_resumed(self):
+        from datetime import datetime
+        from voteit.importparticipants.models import get_import_progress
+        from voteit.importparticipants.parsing import parse_participants
+        (conn, tm, meeting) = self._fixture()
+        progress = get_import_progress(meeting, 'key', create = True, total = 3)
+        progress.queued = datetime.utcnow()
+        tm.commit()
+        participants = parse_participants(u"user1\nuser2\nuser3")
+
+        def _failing():
+            for participant in participants[:2]:
+                yield participant
+            raise ValueError("Lost the upload")
+
+        self._cut(self.config.registry, self.db, meeting._p_oid, 'key', _failing(),
+                  (security.ROLE_VOTER, ), chunk_size = 2)()
+        tm.abort()
+        self.assertEqual(progress.cursor, 2)
+        self.assertEqual(progress.finished, None)
+        self.assertEqual(progress.queued, None)
+        self.assertEqual(list(progress.errors), [u"Lost the upload"])
+        self.assertTrue(progress.failed)
+        self.assertTrue(progress.as_dict()['failed'])
+        # a new job with the same input continues after the committed rows
+        progress.queued = datetime.utcnow()
+        tm.commit()
+        self._cut(self.config.registry, self.db, meeting._p_oid, 'key', iter(participants),
+                  (security.ROLE_VOTER, ), chunk_size = 2)()
+        tm.abort()
+        self.assertTrue(progress.finished)
+        self.assertEqual([x.userid for x in progress.iter_participants()], [u'user1', u'user2', u'user3'])
+
+
+class ImportJobsTests(unittest.TestCase):
+
+    @property
+    def _cut(self):
+        from voteit.importparticipants.jobs import ImportJobs
+        return ImportJobs
+
+    def test_add(self):
+        from threading import Event
+        done = Event()
+        obj = self._cut()
+        obj.add(done.set)
+        done.wait(5)
+        self.assertTrue(done.is_set())
+
+    def test_queue(self):
+        from pyramid_mailer.mailer import DummyMailer
+        mailer = DummyMailer()
+        obj = self._cut(mailer = mailer, batch_size = 2)
+        self.assertTrue(obj.queued)
+        obj.queue(self._mail(3))
+        self.assertEqual([x.recipients for x in mailer.queue],
+                         [[u'user0@test.com'], [u'user1@test.com'], [u'user2@test.com']])
+        self.assertEqual(mailer.outbox, [])
+
+    def test_queue_maildir(self):
+        import os
+        import transaction
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        from pyramid_mailer.mailer import Mailer
+        queue_path = mkdtemp()
+        try:
+            obj = self._cut(mailer = Mailer(queue_path = queue_path, default_sender = 'noreply@test.com'))
+            obj.queue(self._mail(2))
+            transaction.abort()
+            self.assertEqual(os.listdir(os.path.join(queue_path, 'new')), [])
+            obj.queue(self._mail(2))
+            transaction.commit()
+            self.assertEqual(len(os.listdir(os.path.join(queue_path, 'new'))), 2)
+        finally:
+            rmtree(queue_path)
+
+    def test_no_maildir_queue(self):
+        from pyramid_mailer.interfaces import IMailer
+        from pyramid_mailer.mailer import Mailer
+        from voteit.importparticipants.interfaces import ICredentialMailer
+        from voteit.importparticipants.mailing import get_credential_mailer
+        obj = self._cut(registry = self.config.registry)
+        self.config.registry.registerUtility(obj, ICredentialMailer)
+        self.config.registry.registerUtility(Mailer(), IMailer)
+        self.assertFalse(obj.queued)
+        self.assertEqual(get_credential_mailer(self.config.registry), None)
+        self.assertEqual(get_credential_mailer(self.config.registry, queued = False), obj)
+
+    def test_not_configured(self):
+        from voteit.importparticipants.interfaces import ICredentialMailer
+        from voteit.importparticipants.mailing import get_credential_mailer
+        obj = self._cut(registry = self.config.registry)
+        self.config.registry.registerUtility(obj, ICredentialMailer)
+        self.assertFalse(obj.available)
+        self.assertEqual(get_credential_mailer(self.config.registry), None)
+        sleeps = []
+        obj.sleep = sleeps.append
+        # given up right away instead of retrying each message
+        self.assertEqual(obj.deliver(self._mail(3)), 3)
+        self.assertEqual(sleeps, [])
+
+    def test_configured(self):
+        from pyramid_mailer.interfaces import IMailer
+        from pyramid_mailer.mailer import DummyMailer
+        from voteit.importparticipants.interfaces import ICredentialMailer
+        from voteit.importparticipants.mailing import get_credential_mailer
+        obj = self._cut(registry = self.config.registry)
+        self.config.registry.registerUtility(obj, ICredentialMailer)
+        self.config.registry.registerUtility(DummyMailer(), IMailer)
+        self.assertTrue(obj.available)
+        self.assertEqual(get_credential_mailer(self.config.registry), obj)
+
+    def test_smtp(self):
+        import asyncore
+        import smtpd
+        from threading import Thread
+        from pyramid_mailer.mailer import Mailer
+        received = []
+        class Server(smtpd.SMTPServer):
+            def process_message(self, peer, mailfrom, rcpttos, data):
+                received.append((rcpttos, data))
+        server = Server(('127.0.0.1', 0), None)
+        port = server.socket.getsockname()[1]
+        thread = Thread(target = asyncore.loop, kwargs = {'timeout': 0.05})
+        thread.start()
+        try:
+            mailer = Mailer(host = '127.0.0.1', port = port, default_sender = 'noreply@test.com')
+            obj = self._cut(mailer = mailer, retries = 0)
+            self.assertEqual(obj.deliver(self._mail(2)), 0)
+        finally:
+            server.close()
+            thread.join()
+        self.assertEqual([x[0] for x in received], [['user0@test.com'], ['user1@test.com']])
+
+
+class IncludemeTests(unittest.TestCase):
+
+    def test_deferred_imports(self):
+        from voteit.importparticipants.benchmark import measure_startup
+        result = measure_startup('include', repeat = 1)
+        for name in ('formats', 'importer', 'models', 'parsing', 'validators', 'views'):
+            self.assertNotIn('voteit.importparticipants.%s' % name, result['package_modules'])
+        self.assertNotIn('pyramid_mailer', result['packages'])
@@ -0,0 +1,48 @@
+from pyramid.threadlocal import get_current_request
+from slugify import Slugify
+from betahaus.pyracont import get_context_view_names
+
+
+_slugify = Slugify(to_lower = True,
+                   stop_words = ['a', 'an', 'the'],
+                   max_length = 80)
+
+
+def userid_slug(text):
+    """ The userid a new user gets for the requested userid text, before a suffix
+        is added to make it unique. Empty if nothing remains.
+    """
+    return _slugify(text)
+
+
+class UseridAllocator(object):
+    """ Finds unique userids for a batch of requested ones. The existing names in
+        the users folder and its view names are read once, and collisions are
+        resolved with a suffix counter per base name, the same way as generate_slug:
+        user1, user1-1, user1-2...
+    """
+
+    def __init__(self, users, request = None):
+        if request is None:
+            request = get_current_request()
+        self.used = set(users.keys())
+        self.used.update(get_context_view_names(users, request))
+        self.counters = {}
+
+    def __call__(self, requested):
+        """ Return a list with a unique userid for each requested userid. """
+        return [self.allocate(x) for x in requested]
+
+    def allocate(self, text):
+        base = userid_slug(text)
+        if not base:
+            raise ValueError("When text was made URL-friendly, nothing remained.")
+        userid = base
+        if userid in self.used:
+            counter = self.counters.get(base, 0)
+            while userid in self.used:
+                counter += 1
+                userid = u"%s-%s" % (base, counter)
+            self.counters[base] = counter
+        self.used.add(userid)
+        return userid
@@ -1,91 +1,240 @@
 import re
 import colander
-import csv
+import peppercorn
 
-from StringIO import StringIO
 from pyramid.traversal import find_root
+from pyramid.url import resource_url
 
+from voteit.core import security
 from voteit.core.validators import html_string_validator
-from voteit.core.validators import UniqueEmail
 from voteit.core.validators import NEW_USERID_PATTERN
 
 from voteit.importparticipants import VoteITImportParticipants as _
+from voteit.importparticipants.formats import get_participant_format
+from voteit.importparticipants.importer import import_key
+from voteit.importparticipants.importer import participants_digest
+from voteit.importparticipants.instrumentation import get_instrumentation
+from voteit.importparticipants.models import get_import_progress
+from voteit.importparticipants.models import has_import_progress
+from voteit.importparticipants.parsing import parse_participants
+from voteit.importparticipants.parsing import split_roles
+from voteit.importparticipants.report import REPORT_SESSION_KEY
+from voteit.importparticipants.report import ReportFull
+from voteit.importparticipants.report import ValidationReport
+from voteit.importparticipants.report import get_max_errors
+from voteit.importparticipants.userids import userid_slug
+
+
+_SHOWN_VALUES = 10
+
+
+def parse_csv_participants(node, value):
+    """ Parse pasted csv into a list of Participant records.
+        Raises colander.Invalid if the input isn't usable.
+    """
+    instrumentation = get_instrumentation()
+    with instrumentation.phase('html_validation'):
+        html_string_validator(node, value)
+    with instrumentation.phase('parse') as record:
+        participants = parse_participants(value)
+        record['rows'] = len(participants)
+    return participants
+
+
+def submitted_roles(request):
+    """ The roles posted with the form. A field validator only gets the value of
+        its own field, so they're read from the controls, before they've been validated.
+    """
+    return tuple(peppercorn.parse(request.POST.items()).get('roles', ()))
+
+
+def build_email_index(users):
+    """ Return a dict with normalized (stripped and lowercased) email addresses
+        as keys and userids as values, for every user in users that has an email.
+    """
+    index = {}
+    for (userid, user) in users.items():
+        email = user.get_field_value('email')
+        if email:
+            index[email.strip().lower()] = userid
+    return index
 
 
-@colander.deferred
-def csv_participant_validator(node, kw):
-    context = kw['context']
-    api = kw['api']
-    return CSVParticipantValidator(context, api)
-    
 class CSVParticipantValidator(object):
     """
-        validates that input is a valid csv file
+        validates that input is a valid csv file. Accepts either the csv as a string
+        or Participant records that have already been parsed.
+        With sync, rows may refer to users that already exist, as long as the email
+        isn't registered to someone else.
+        With resume, rows committed by an earlier import of the same input with the
+        submitted roles aren't checked. Only for forms where the view looks up that
+        import and resumes it, or shows its result, instead of importing the rows again.
     """
-    def __init__(self, context, api):
+    def __init__(self, context, api, sync = False, resume = False):
         self.context = context
         self.api = api
+        self.sync = sync
+        self.resume = resume
     
     def __call__(self, node, value):
-        html_string_validator(node, value)
-        
+        if isinstance(value, basestring):
+            value = parse_csv_participants(node, value)
+        self.validate(node, value, skip = self._committed_rows(value))
+
+    def _committed_rows(self, participants):
+        """ Number of rows already committed by an earlier import with the same
+            import key, or 0 if there is none or resume isn't set.
+        """
+        if not self.resume or not has_import_progress(self.context):
+            return 0
+        key = import_key(self.context, submitted_roles(self.api.request), participants_digest(participants))
+        progress = get_import_progress(self.context, key)
+        return progress and progress.cursor or 0
+
+    def validate(self, node, participants, skip = 0, check_html = False):
+        report = self.check(participants, skip = skip, check_html = check_html)
+        if report:
+            self.api.request.session[REPORT_SESSION_KEY] = report.entries
+            raise colander.Invalid(node, self.summary(report))
+
+    def check(self, participants, skip = 0, check_html = False):
+        """ Check participants and return a ValidationReport with the errors found.
+            The first skip rows are counted but not checked. If check_html is true,
+            each row is also checked for html, for input that hasn't been checked
+            as a whole.
+        """
+        instrumentation = get_instrumentation()
+        request = self.api.request
         users = find_root(self.context).users
-        
-        nouserid = set()
-        invalid = set()
-        notunique = set()
-        email = set()
-        password = set()
+        # built once per validation instead of searching all users for each row
+        with instrumentation.phase('email_index', rows = len(users)):
+            emails = build_email_index(users)
+        batch_emails = set()
+        email_validator = colander.Email()
+        valid_roles = set(name for (name, title) in security.MEETING_ROLES)
+
+        report = ValidationReport(limit = get_max_errors(request.registry))
         row_count = 0
-        # the value shoud be in unicode from colander and csv wants ascii or utf-8 
-        value = value.encode('UTF-8')
-        data = csv.reader(StringIO(value), delimiter=';', quotechar='"')
-        try:
-            for row in data:
-                row_count = row_count + 1
-                if not row[0]:
-                    nouserid.add("%s" % row_count) 
-                if row[0] and not NEW_USERID_PATTERN.match(row[0]):
-                    invalid.add(row[0])
-                if row[0] in users:
-                    notunique.add(row[0])
-                # only validate email if there is an email
-                if len(row) > 2 and row[2]:
-                    try:
-                        UniqueEmail(self.context)(node, row[2])
-                    except colander.Invalid:
-                        email.add("%s" % row[2])
-        except IndexError:
-            raise colander.Invalid(node, _('add_participants_invalid_csv',
-                                           default=u"""CSV file is not valid, make sure at least userid is specified on 
-                                           each row and field delimiter is ; and text delimiter is " """))
+        with instrumentation.phase('row_checks') as record:
+            try:
+                for participant in participants:
+                    row_count = row_count + 1
+                    if row_count <= skip:
+                        continue
+                    row = participant.row or row_count
+                    if check_html:
+                        try:
+                            html_string_validator(None, u" ".join(participant.values()))
+                        except colander.Invalid:
+                            report.add(row, None, 'html', u"%s" % row)
+                    userid = participant.userid
+                    # sync matches rows with users by the userid a new user would get
+                    existing_id = self.sync and userid and userid_slug(userid) or userid
+                    existing = existing_id in users
+                    if not userid:
+                        report.add(row, 'userid', 'no_userid', u"%s" % row)
+                    elif existing and self.sync:
+                        pass
+                    elif not NEW_USERID_PATTERN.match(userid):
+                        report.add(row, 'userid', 'invalid_userid', userid)
+                    if existing and not self.sync:
+                        report.add(row, 'userid', 'registered_userid', userid)
+                    for role in split_roles(participant.roles):
+                        if role not in valid_roles:
+                            report.add(row, 'roles', 'invalid_role', role)
+                    # only validate email if there is an email
+                    if participant.email:
+                        address = participant.email
+                        normalized = address.strip().lower()
+                        try:
+                            email_validator(None, address)
+                        except colander.Invalid:
+                            report.add(row, 'email', 'invalid_email', address)
+                            continue
+                        if normalized in batch_emails:
+                            report.add(row, 'email', 'duplicate_email', address)
+                        elif normalized in emails and emails[normalized] != existing_id:
+                            report.add(row, 'email', 'registered_email', address)
+                        else:
+                            batch_emails.add(normalized)
+            except ReportFull:
+                pass
+            finally:
+                record['rows'] = row_count
+        return report
+
+    def summary(self, report):
+        """ A compact translated description of the errors in report. """
+
+        def _values(*codes):
+            values = []
+            for code in codes:
+                values.extend(report.values(code))
+            text = u", ".join(values[:_SHOWN_VALUES])
+            if len(values) > _SHOWN_VALUES:
+                text += u" " + self.api.translate(_('add_participants_more_values',
+                                                    default = u"(and ${count} more)",
+                                                    mapping = {'count': len(values) - _SHOWN_VALUES}))
+            return text
 
         msgs = []
-        if nouserid: 
+        if report.values('no_userid'):
             msgs.append(self.api.translate(_('add_participants_no_userid_error',
                            default=u"The following rows had no userid specified: ${nouserid}.",
-                           mapping={'nouserid': nouserid})))
-        if invalid: 
-            invalid = ", ".join(invalid)
+                           mapping={'nouserid': _values('no_userid')})))
+        if report.values('invalid_userid'):
             msgs.append(self.api.translate(_('add_participants_userid_char_error',
                          default=u"The following userids is invalid: ${invalid}. UserID must be 3-30 chars, start with lowercase a-z and only contain lowercase a-z, numbers, minus and underscore.",
-                         mapping={'invalid': invalid})))
-        if notunique: 
-            notunique = ", ".join(notunique)
+                         mapping={'invalid': _values('invalid_userid')})))
+        if report.values('registered_userid'):
             msgs.append(self.api.translate(_('add_participants_notunique_error',
                     default=u"The following userids is already registered: ${notunique}.",
-                    mapping={'notunique': notunique})))
-        if email: 
-            email = ", ".join(email)
+                    mapping={'notunique': _values('registered_userid')})))
+        if report.values('invalid_email') or report.values('registered_email'):
             msgs.append(self.api.translate(_('add_participants_email_error',
                     default=u"The following email addresses is invalid or already registered: ${email}.",
-                    mapping={'email': email})))
-        if password: 
-            password = ", ".join(password)
-            msgs.append(self.api.translate(_('add_participants_password_error',
-                    default=u"The following rows has invalid password: ${password}. Password must be between 6 and 100 characters",
-                    mapping={'password': password})))
-            
-        if msgs:
-            msg = "\n".join(msgs)
-            raise colander.Invalid(node, msg)
+                    mapping={'email': _values('invalid_email', 'registered_email')})))
+        if report.values('duplicate_email'):
+            msgs.append(self.api.translate(_('add_participants_duplicate_email_error',
+                    default=u"The following email addresses occur more than once in the list: ${duplicate_email}.",
+                    mapping={'duplicate_email': _values('duplicate_email')})))
+        if report.values('invalid_role'):
+            msgs.append(self.api.translate(_('add_participants_invalid_role_error',
+                    default=u"The following roles don't exist: ${roles}.",
+                    mapping={'roles': _values('invalid_role')})))
+        if report.values('html'):
+            msgs.append(self.api.translate(_('add_participants_html_error',
+                    default=u"The following rows contain html, which isn't allowed: ${rows}.",
+                    mapping={'rows': _values('html')})))
+        if report.full:
+            msgs.append(self.api.translate(_('add_participants_error_limit',
+                    default=u"Validation stopped after ${count} errors.",
+                    mapping={'count': report.limit})))
+        msgs.append(self.api.translate(_('add_participants_report_link',
+                default=u"A report with the row and column of each error can be downloaded from: ${url}",
+                mapping={'url': resource_url(self.context, self.api.request, 'import_report.csv')})))
+        return u"\n".join(msgs)
+
+
+class CSVFileParticipantValidator(CSVParticipantValidator):
+    """
+        validates an uploaded file row by row, without reading the whole
+        file into memory. The format is picked from the file extension, see
+        formats.get_participant_format. The file is rewound afterwards so it
+        can be imported.
+    """
+
+    def __call__(self, node, value):
+        fp = value['fp']
+        read = get_participant_format(self.api.request.registry, value.get('filename'))
+        fp.seek(0)
+        try:
+            skip = self._committed_rows(read(fp))
+            fp.seek(0)
+            self.validate(node, read(fp), skip = skip, check_html = True)
+        except ValueError, exc:
+            raise colander.Invalid(node, _('add_participants_unreadable_file',
+                                           default = u"The file couldn't be read: ${error}",
+                                           mapping = {'error': unicode(exc)}))
+        finally:
+            fp.seek(0)
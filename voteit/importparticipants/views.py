@@ -1,78 +1,257 @@
-import csv
-import random
-
-from StringIO import StringIO
+import json
+import os
+from datetime import datetime
+from tempfile import TemporaryFile
+from uuid import uuid4
 
 import colander
+import transaction
 from deform import Form
 from deform.exception import ValidationFailure
-from pyramid.view import view_config
 from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPNotFound
 from pyramid.url import resource_url
+from pyramid.traversal import find_root
 from pyramid.renderers import render
 from pyramid.response import Response
-from betahaus.pyracont.factories import createContent
+from pyramid.decorator import reify
 from betahaus.pyracont.factories import createSchema
 
 from voteit.core import security
 from voteit.core.views.base_view import BaseView
-from voteit.core.models.interfaces import IMeeting
 from voteit.core.models.schemas import add_csrf_token
 from voteit.core.models.schemas import button_add
 from voteit.core.models.schemas import button_cancel
-from voteit.core.helpers import generate_slug
 
 from voteit.importparticipants import VoteITImportParticipants as _
+from voteit.importparticipants.credentials import get_credential_generator
+from voteit.importparticipants.formats import get_participant_format
+from voteit.importparticipants.hashing import get_password_hasher
+from voteit.importparticipants.importer import ParticipantImporter
+from voteit.importparticipants.instrumentation import get_instrumentation
+from voteit.importparticipants.importer import get_chunk_size
+from voteit.importparticipants.importer import get_defer_indexing
+from voteit.importparticipants.importer import import_key
+from voteit.importparticipants.importer import participants_digest
+from voteit.importparticipants.interfaces import IImportJobs
+from voteit.importparticipants.jobs import BACKGROUND_CHUNK_SIZE
+from voteit.importparticipants.jobs import ImportJob
+from voteit.importparticipants.jobs import STALE_JOB_AFTER
+from voteit.importparticipants.jobs import get_background_threshold
+from voteit.importparticipants.mailing import credential_mail
+from voteit.importparticipants.mailing import get_credential_mailer
+from voteit.importparticipants.models import expire_import_results
+from voteit.importparticipants.models import find_import_progress
+from voteit.importparticipants.models import get_import_progress
+from voteit.importparticipants.models import get_result_dir
+from voteit.importparticipants.models import get_result_max_age
+from voteit.importparticipants.models import store_import_result
+from voteit.importparticipants.parsing import iter_csv
+from voteit.importparticipants.parsing import iter_ndjson_participants
+from voteit.importparticipants.parsing import parse_json_participants
+from voteit.importparticipants.parsing import parse_participants
+from voteit.importparticipants.parsing import spool_participants
+from voteit.importparticipants.report import REPORT_SESSION_KEY
+from voteit.importparticipants.report import iter_report_csv
+from voteit.importparticipants.sync import RosterSync
+from voteit.importparticipants.validators import CSVParticipantValidator
+
+
+RESULT_PREVIEW_ROWS = 20
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+JSON_CONTENT_TYPES = ('application/json', NDJSON_CONTENT_TYPE)
+
+
+def _json_response(data, status = 200):
+    return Response(json.dumps(data), status = status,
+                    content_type = 'application/json', charset = 'UTF-8')
+
+
+def _iter_file(fp, block_size = 64 * 1024):
+    """ Read fp in blocks, as a response app_iter. fp is closed when the response is done. """
+    try:
+        while True:
+            data = fp.read(block_size)
+            if not data:
+                return
+            yield data
+    finally:
+        fp.close()
+
 
+class _NDJSONResults(object):
+    """ Writes imported participants to a temporary file, one json object per line,
+        for imports from the api where the passwords shouldn't be stored.
+    """
 
-_PW_CHARS = 'abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+    def __init__(self):
+        self.fp = TemporaryFile()
+
+    def add(self, participant):
+        self.fp.write(json.dumps(participant.as_dict()) + "\n")
 
 
 class AddParticipantsView(BaseView):
     
+    @reify
+    def _instrumentation(self):
+        return get_instrumentation(self.request.registry)
+
+    @reify
+    def _result_dir(self):
+        return get_result_dir(self.request.registry)
+
     def _generate_password(self):
-        return ''.join(random.choice(_PW_CHARS) for x in range(10))
+        return self._generate_passwords(1)[0]
+
+    def _generate_passwords(self, count):
+        return get_credential_generator(self.request.registry).generate(count)
+
+    def _importer(self, roles, meetings = ()):
+        return ParticipantImporter(self.context, roles,
+                                   generate_passwords = self._generate_passwords,
+                                   defer_indexing = get_defer_indexing(self.request.registry),
+                                   hasher = get_password_hasher(self.request.registry),
+                                   instrumentation = self._instrumentation,
+                                   meetings = meetings)
     
-    def _import_participants(self, input, roles):
-        # the value shoud be in unicode from colander and csv wants ascii or utf-8
-        input = input.encode('UTF-8')
-        participants = csv.reader(StringIO(input), delimiter=';', quotechar='"')
-        output = []
-        for row in participants:
-            appstruct = {}
-            userid = unicode(row[0])
-            if len(row) > 1 and row[1]:
-                appstruct['password'] = unicode(row[1])
-            else:
-                appstruct['password'] = self._generate_password()
-            if len(row) > 2 and row[2]:
-                appstruct['email'] = unicode(row[2])
-            else:
-                appstruct['email'] = u""
-            if len(row) > 3 and row[3]:
-                appstruct['first_name'] = row[3].decode('UTF-8')
-            else:
-                appstruct['first_name'] = u""
-            if len(row) > 4 and row[4]:
-                appstruct['last_name'] = row[4].decode('UTF-8')
-            else:
-                appstruct['last_name'] = u""
-            
-            # add user to root
-            from betahaus.pyracont import generate_slug
-            userid = generate_slug(self.api.root.users, userid)
-            user = createContent('User', creators=[userid], **appstruct)
-            self.api.root.users[userid] = user
-            
-            # add user to meeting
-            self.context.add_groups(userid, roles, event = True)
-            
-            appstruct['userid'] = userid
-            output.append(appstruct)
-            
-        return output
+    def _import_participants(self, participants, roles):
+        """ Create users from Participant records and add them to this meeting.
+            participants may be any iterable, like a stream from an uploaded file, or
+            unparsed csv. Returns a list of the records, updated with the final userid
+            and password.
+        """
+        if isinstance(participants, basestring):
+            participants = parse_participants(participants)
+        return self._importer(roles)(participants)
+
+    def _import_participants_chunked(self, importer, get_participants, chunk_size, key, digest, results = None):
+        """ Import into the ImportProgress with key, with a commit every chunk_size rows,
+            or in the surrounding transaction if chunk_size is 0. The result of each
+            batch is written to the progress record, or to results if it's given,
+            so the rows aren't collected in a list.
+            If an earlier attempt with the same key was aborted, it's resumed from the
+            last committed chunk.
+            The start time is committed before any rows are imported, so a retry of
+            the same import while this one is running is sent to its status page.
+            If the import fails, the error is recorded so a retry resumes it at once.
+            get_participants must return a new iterable over the same rows each time it's called.
+        """
+        progress = get_import_progress(self.context, key, create = True, digest = digest)
+        if results is None:
+            progress.spool_results(self._result_dir)
+        progress.started = datetime.utcnow()
+        progress.errors = ()
+        transaction.commit()
+        try:
+            importer.import_chunked(get_participants(), progress, chunk_size, results = results)
+        except Exception, exc:
+            transaction.abort()
+            progress.add_error(unicode(exc))
+            transaction.commit()
+            raise
+        progress.total = progress.cursor
+        progress.finished = datetime.utcnow()
+        return progress
+
+    def _queue_import(self, get_participants, roles, total, key, digest, mail = None):
+        """ Run the import as a background job when this request has been committed,
+            and redirect to a page that shows its progress. If mail is given, it's
+            sent to the imported participants when the job is done.
+        """
+        registry = self.request.registry
+        progress = get_import_progress(self.context, key, create = True, digest = digest)
+        progress.spool_results(self._result_dir)
+        progress.total = total
+        progress.queued = datetime.utcnow()
+        # errors of an earlier attempt that's resumed now
+        progress.errors = ()
+        participants = get_participants()
+        if not isinstance(participants, list):
+            participants = spool_participants(participants)
+        job = ImportJob(registry, self.context._p_jar.db(), self.context._p_oid, key, participants, roles,
+                        chunk_size = get_chunk_size(registry) or BACKGROUND_CHUNK_SIZE,
+                        defer_indexing = get_defer_indexing(registry),
+                        mail = mail)
+        registry.getUtility(IImportJobs).add_after_commit(job)
+        self.api.flash_messages.add(_('import_queued_text',
+                                      default = u"The import of ${count} participants has been queued",
+                                      mapping = {'count': total}))
+        return self._status_redirect(progress)
+
+    def _credential_mail(self):
+        """ A CredentialMail without recipients, or None if mail isn't configured. """
+        if get_credential_mailer(self.request.registry) is None:
+            self.api.flash_messages.add(_('credentials_mail_unavailable_error',
+                                          default = u"Email with a mail queue isn't configured on this site, so no credentials were sent."),
+                                        type = 'error')
+            return None
+        return credential_mail(self.request, self.context)
+
+    def _send_credentials(self, participants):
+        """ Queue emails with their credentials to participants, written to the mail
+            queue when this request is committed.
+        """
+        mail = self._credential_mail()
+        if mail is None:
+            return
+        mail.add(participants)
+        get_credential_mailer(self.request.registry).queue(mail)
+        self.api.flash_messages.add(_('credentials_mail_queued_text',
+                                      default = u"Credentials will be emailed to ${count} participants",
+                                      mapping = {'count': len(mail.recipients)}))
+
+    def _status_redirect(self, progress):
+        url = resource_url(self.context, self.request, 'import_status', query = {'key': progress.key})
+        return HTTPFound(location = url)
+
+    def _get_progress(self):
+        self._expire_results()
+        progress = get_import_progress(self.context, self.request.GET.get('key', ''))
+        if progress is None:
+            raise HTTPNotFound()
+        return progress
+
+    def _expire_results(self):
+        """ Forget stored results older than the setting voteit.importparticipants.result_max_age. """
+        expire_import_results(self.context, get_result_max_age(self.request.registry))
+
+    def _render_result(self, output, total = None, progress = None):
+        """ Render the imported participants. If there are more than RESULT_PREVIEW_ROWS,
+            only the first ones are shown, and the rest can be downloaded as csv.
+            The result is kept in progress, or a new ImportProgress, until it expires.
+            output may contain only the first rows if total is specified.
+        """
+        if total is None:
+            total = len(output)
+        if total > RESULT_PREVIEW_ROWS:
+            if progress is None:
+                progress = store_import_result(self.context, uuid4().hex, output, result_dir = self._result_dir)
+            self.response['download_url'] = resource_url(self.context, self.request, 'import_credentials.csv',
+                                                         query = {'key': progress.key})
+            output = output[:RESULT_PREVIEW_ROWS]
+        self.response['total'] = total
+
+        msg = _('added_participants_text', default=u"Successfully added ${participant_count} participants", mapping={'participant_count':total} )
+        self.api.flash_messages.add(msg)
+        
+        self.response['heading'] = "%s %s" % (total, self.api.pluralize(self.api.translate(_("participant added")), self.api.translate(_("participants added")), total))
+        self.response['participants'] = output
+        with self._instrumentation.phase('render', rows = len(output)):
+            return Response(render("add_participants.pt", self.response, request = self.request))
     
-    @view_config(name="add_participants", context=IMeeting, renderer="voteit.core.views:templates/base_edit.pt", permission=security.MANAGE_GROUPS)
+    def _stored_result(self, progress):
+        """ Render the result of a finished import, or go back to the meeting if
+            the result has already been shown.
+        """
+        if progress.cleared:
+            self.api.flash_messages.add(_('import_result_cleared_text',
+                                          default = u"${count} participants were imported. Their passwords have expired and are no longer stored.",
+                                          mapping = {'count': progress.cursor}))
+            return HTTPFound(location = resource_url(self.context, self.request))
+        output = progress.get_participants(limit = RESULT_PREVIEW_ROWS + 1)
+        return self._render_result(output, total = progress.result_count, progress = progress)
+
     def add_participants(self):
         """ Add participants to this meeting.
             Renders a form where you can paste a csv with the users and select which roles they
@@ -80,14 +259,82 @@ class AddParticipantsView(BaseView):
             passwords is displayed 
         """
         self.response['title'] = _(u"Add meeting participants")
+        return self._participants_form('AddParticipantsSchema', lambda appstruct: appstruct['csv'])
+
+    def add_participants_file(self):
+        """ Same as add_participants, but the csv is uploaded as a file.
+            Both validation and import read the file row by row from the request body
+            file, so the size of the roster doesn't affect how much is kept in memory
+            while reading it.
+        """
+        self.response['title'] = _(u"Add meeting participants from file")
+        return self._participants_form('AddParticipantsFileSchema', self._uploaded_participants, stream = True)
 
+    def sync_participants(self):
+        """ Apply an uploaded roster to this meeting. Only the differences are written:
+            missing users are created, and the selected roles are added to or removed
+            from existing users where they differ. See sync.RosterSync
+        """
+        self.response['title'] = _(u"Sync meeting participants")
+        return self._participants_form('SyncParticipantsSchema', self._uploaded_participants,
+                                       handle = self._sync_participants)
+
+    def _sync_participants(self, appstruct, participants):
+        roles = appstruct['roles']
+        sync = RosterSync(self.context, roles, self._importer(roles), keep = (self.api.userid, ))
+        sync(participants)
+        self.api.flash_messages.add(_('sync_participants_text',
+                                      default = u"Roles were added to ${added} and removed from ${removed} participants. ${unchanged} were unchanged.",
+                                      mapping = {'added': len(sync.added),
+                                                 'removed': len(sync.removed),
+                                                 'unchanged': sync.unchanged}))
+        if appstruct.get('send_credentials'):
+            self._send_credentials(sync.created)
+        return self._render_result(sync.created)
+
+    def add_participants_multiple(self):
+        """ Same as add_participants, but the users are also added to other meetings
+            with roles for each meeting. The roster is validated and the users are
+            created once.
+        """
+        self.response['title'] = _(u"Add participants to several meetings")
+        return self._participants_form('AddParticipantsMultipleSchema', lambda appstruct: appstruct['csv'],
+                                       handle = self._import_multiple)
+
+    def _import_multiple(self, appstruct, participants):
+        root = find_root(self.context)
+        targets = dict((x['meeting'], x['roles']) for x in appstruct['meetings'])
+        meetings = [(root[name], roles) for (name, roles) in sorted(targets.items())]
+        output = self._importer(appstruct['roles'], meetings = meetings)(participants)
+        self.api.flash_messages.add(_('add_participants_multiple_text',
+                                      default = u"The participants were added to ${count} meetings",
+                                      mapping = {'count': len(meetings) + 1}))
+        if appstruct.get('send_credentials'):
+            self._send_credentials(output)
+        return self._render_result(output)
+
+    def _uploaded_participants(self, appstruct):
+        upload = appstruct['upload']
+        fp = upload['fp']
+        fp.seek(0)
+        return get_participant_format(self.request.registry, upload.get('filename'))(fp)
+
+    def _participants_form(self, schema_name, get_participants, handle = None, stream = False):
+        """ Handle the add participants form. get_participants is called with the
+            validated appstruct and should return the participants to import.
+            It may be called more than once.
+            If handle is given, it's called with the appstruct and the participants
+            instead of importing them, and should return the response.
+            If stream is true, the import is committed in chunks even if chunking
+            isn't configured, so memory doesn't grow with the size of the input.
+        """
         post = self.request.POST
         if 'cancel' in post:
             self.api.flash_messages.add(_(u"Canceled"))
             url = resource_url(self.context, self.request)
             return HTTPFound(location=url)
 
-        schema = createSchema('AddParticipantsSchema').bind(context=self.context, request=self.request, api=self.api)
+        schema = createSchema(schema_name).bind(context=self.context, request=self.request, api=self.api)
         add_csrf_token(self.context, self.request, schema)
 
         form = Form(schema, buttons=(button_add, button_cancel))
@@ -96,23 +343,216 @@ class AddParticipantsView(BaseView):
         if 'add' in post:
             controls = post.items()
             try:
-                appstruct = form.validate(controls)
+                with self._instrumentation.phase('form_validation'):
+                    appstruct = form.validate(controls)
             except ValidationFailure, e:
                 self.response['form'] = e.render()
                 return self.response
             
             roles = appstruct['roles']
+            self._expire_results()
+            if handle is not None:
+                return handle(appstruct, get_participants(appstruct))
 
-            output = self._import_participants(appstruct['csv'], roles)
-                          
-            msg = _('added_participants_text', default=u"Successfully added ${participant_count} participants", mapping={'participant_count':len(output)} )
-            self.api.flash_messages.add(msg)
-            
-            self.response['heading'] = "%s %s" % (len(output), self.api.pluralize(self.api.translate(_("participant added")), self.api.translate(_("participants added")), len(output)))
-            self.response['participants'] = output
-            return Response(render("add_participants.pt", self.response, request = self.request))
+            # a retry of the same import, for instance after a timeout, gets the first result
+            digest = participants_digest(get_participants(appstruct))
+            key = import_key(self.context, roles, digest)
+            progress = get_import_progress(self.context, key)
+            if progress is not None:
+                if progress.finished:
+                    self.api.flash_messages.add(_('import_retry_text',
+                                                  default = u"This import has already been done"))
+                    return self._stored_result(progress)
+                if progress.queued:
+                    jobs = self.request.registry.queryUtility(IImportJobs)
+                    if (jobs is not None and jobs.is_pending(key)) or not progress.is_stale(STALE_JOB_AFTER):
+                        return self._status_redirect(progress)
+                    # The job is lost, like when the server was restarted. It's queued
+                    # again below, and continues after the last committed row.
+                    progress.queued = None
+                elif progress.started and not progress.failed and not progress.is_stale(STALE_JOB_AFTER):
+                    # still being imported by an earlier request, like when a proxy
+                    # timed out and the form was submitted again
+                    return self._status_redirect(progress)
+            elif find_import_progress(self.context, digest) is not None:
+                self.api.flash_messages.add(_('import_other_roles_error',
+                                              default = u"These participants have already been imported with other roles. Use sync to change their roles."),
+                                            type = 'error')
+                return HTTPFound(location = resource_url(self.context, self.request))
+
+            threshold = get_background_threshold(self.request.registry)
+            if threshold:
+                total = sum(1 for x in get_participants(appstruct))
+                if total > threshold:
+                    mail = None
+                    if appstruct.get('send_credentials'):
+                        mail = self._credential_mail()
+                    return self._queue_import(lambda: get_participants(appstruct), roles, total, key, digest, mail = mail)
+
+            importer = self._importer(roles)
+            chunk_size = get_chunk_size(self.request.registry)
+            if not chunk_size and (stream or progress is not None):
+                # resume an interrupted chunked import even if chunking has been turned off
+                chunk_size = BACKGROUND_CHUNK_SIZE
+            if progress is not None and progress.cursor:
+                self.api.flash_messages.add(_('resumed_import_text',
+                                              default = u"Resumed an interrupted import after row ${cursor}",
+                                              mapping = {'cursor': progress.cursor}))
+            progress = self._import_participants_chunked(importer, lambda: get_participants(appstruct), chunk_size, key, digest)
+            if importer.defer_indexing:
+                self.api.flash_messages.add(_('import_timings_text',
+                                              default = u"Creating users took ${create} seconds and indexing them took ${index} seconds",
+                                              mapping = {'create': "%.1f" % importer.timings['create'],
+                                                         'index': "%.1f" % importer.timings['index']}))
+            if appstruct.get('send_credentials'):
+                self._send_credentials(progress.iter_participants())
+            output = progress.get_participants(limit = RESULT_PREVIEW_ROWS + 1)
+            return self._render_result(output, total = progress.cursor, progress = progress)
 
 
         #No action - Render add form
         self.response['form'] = form.render()
-        return self.response
\ No newline at end of file
+        return self.response
+
+    def import_report_csv(self):
+        """ Download the row level errors from the last failed validation of an import. """
+        entries = self.request.session.get(REPORT_SESSION_KEY, ())
+        response = Response(content_type = 'text/csv', charset = 'UTF-8',
+                            app_iter = iter_report_csv(entries))
+        response.content_disposition = 'attachment; filename="import_errors.csv"'
+        return response
+
+    def import_status(self):
+        """ Page that shows the progress of a background import, and links to the
+            result when it's done.
+        """
+        self.response['progress'] = self._get_progress()
+        return self.response
+
+    def import_status_json(self):
+        """ Rows processed, errors and ETA of a background import. """
+        progress = self._get_progress()
+        status = progress.as_dict()
+        if status['finished']:
+            status['result_url'] = resource_url(self.context, self.request, 'import_result', query = {'key': progress.key})
+        return status
+
+    def import_result(self):
+        """ Show the participants created by a finished background import.
+            The result is kept until it expires, see _expire_results.
+        """
+        progress = self._get_progress()
+        if not progress.finished:
+            url = resource_url(self.context, self.request, 'import_status', query = {'key': progress.key})
+            return HTTPFound(location = url)
+        for error in progress.errors:
+            self.api.flash_messages.add(error, type = 'error')
+        return self._stored_result(progress)
+
+    def import_credentials_csv(self):
+        """ Download the userids and passwords of a finished import as csv.
+            The result is kept until it expires, so an interrupted download can be
+            started again. A result in the database is written to a temporary file
+            first, since the database connection has been closed when the response
+            body is sent.
+        """
+        progress = self._get_progress()
+        if not progress.finished or progress.cleared:
+            raise HTTPNotFound()
+        if progress.result_path is not None:
+            if not os.path.exists(progress.result_path):
+                raise HTTPNotFound()
+            fp = open(progress.result_path, 'rb')
+        else:
+            fp = TemporaryFile()
+            for line in iter_csv(progress.iter_participants()):
+                fp.write(line)
+            fp.seek(0)
+        response = Response(content_type = 'text/csv', charset = 'UTF-8',
+                            app_iter = _iter_file(fp))
+        response.content_disposition = 'attachment; filename="participants.csv"'
+        return response
+
+    def import_participants_json(self):
+        """ Import participants from json, for integrations.
+            The body is either an object like {"roles": [...], "participants": [{"userid": ...}, ...]}
+            or, with content type application/x-ndjson, one participant object per line
+            with roles as repeated query parameters. NDJSON is read row by row from the
+            request body and imported in chunks that are committed one at a time, and
+            the result of each batch is spooled to a file that's sent back as NDJSON.
+            The rows are validated the same way as the form, and on errors nothing is
+            imported and the row level errors are returned with status 400.
+            Passwords aren't stored, so a repeated import of rows that have all been
+            imported is refused with status 409. A retry of an interrupted import
+            continues after its last committed chunk and returns the rest of the rows,
+            and a retry while it's still running gets status 202.
+            Other content types are refused with status 415. A form on another site
+            can't post json content types without a CORS preflight, so this keeps the
+            endpoint from being used with the cookie of a logged in user.
+        """
+        if self.request.content_type not in JSON_CONTENT_TYPES:
+            return _json_response({'status': 'error',
+                                   'message': u"Content type must be one of: %s" % ", ".join(JSON_CONTENT_TYPES)},
+                                  status = 415)
+        ndjson = self.request.content_type == NDJSON_CONTENT_TYPE
+        try:
+            if ndjson:
+                roles = self.request.GET.getall('roles')
+                fp = self.request.body_file_seekable
+                def get_participants():
+                    fp.seek(0)
+                    return iter_ndjson_participants(fp)
+            else:
+                data = self.request.json_body
+                if not isinstance(data, dict):
+                    raise ValueError("Body must be a json object")
+                roles = data.get('roles', ())
+                participants = parse_json_participants(data.get('participants'))
+                get_participants = lambda: participants
+            valid_roles = set(name for (name, title) in security.MEETING_ROLES)
+            invalid_roles = [x for x in roles if x not in valid_roles]
+            if invalid_roles:
+                raise ValueError("Invalid roles: %s" % ", ".join(invalid_roles))
+            # Passwords aren't stored for the api, so a finished import can't be
+            # answered again. An interrupted one is resumed after its last chunk.
+            digest = participants_digest(get_participants())
+            key = import_key(self.context, roles, digest)
+            progress = get_import_progress(self.context, key)
+            if progress is not None:
+                if progress.finished:
+                    return _json_response({'status': 'duplicate', 'key': key,
+                                           'message': u"These participants have already been imported"}, status = 409)
+                if progress.started and not progress.failed and not progress.is_stale(STALE_JOB_AFTER):
+                    return _json_response({'status': 'running', 'key': key, 'processed': progress.cursor,
+                                           'message': u"These participants are being imported by an earlier request"}, status = 202)
+            else:
+                other = find_import_progress(self.context, digest)
+                if other is not None and other.finished:
+                    return _json_response({'status': 'duplicate', 'key': other.key,
+                                           'message': u"These participants have already been imported with other roles"}, status = 409)
+            validator = CSVParticipantValidator(self.context, self.api)
+            skip = progress is not None and progress.cursor or 0
+            report = validator.check(get_participants(), skip = skip, check_html = True)
+        except ValueError, exc:
+            return _json_response({'status': 'error', 'message': unicode(exc)}, status = 400)
+        if report:
+            errors = [dict(row = row, column = column, code = code, value = value)
+                      for (row, column, code, value) in report.entries]
+            return _json_response({'status': 'invalid', 'errors': errors, 'truncated': report.full}, status = 400)
+        importer = self._importer(roles)
+        chunk_size = get_chunk_size(self.request.registry)
+        if not chunk_size and (ndjson or progress is not None):
+            chunk_size = BACKGROUND_CHUNK_SIZE
+        # The result is written a batch at a time to a temporary file instead of the
+        # progress record. It's sent as the body, since importing from the app_iter
+        # isn't possible: the transaction has been committed and the connection
+        # closed by then. A resumed import only returns the rows it imported.
+        results = _NDJSONResults()
+        progress = self._import_participants_chunked(importer, get_participants, chunk_size, key, digest,
+                                                     results = results)
+        progress.cleared = True
+        results.fp.seek(0)
+        if ndjson:
+            return Response(content_type = NDJSON_CONTENT_TYPE, charset = 'UTF-8',
+                            app_iter = _iter_file(results.fp))
+        return _json_response({'status': 'ok', 'results': [json.loads(x) for x in results.fp]})